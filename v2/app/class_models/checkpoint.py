@@ -0,0 +1,101 @@
+import sqlite3
+from asyncio import to_thread
+from pathlib import Path
+from threading import Lock
+from typing import Iterator
+
+
+class PipelineCheckpoint:
+
+    def __init__(self, path: str | Path):
+        """
+        :param path: SQLite file of a single pipeline, created if missing.
+        Disk-backed frontier of a pipeline. Every url handed to a step is recorded as pending and gets marked
+        completed only once whatever the step made out of it has been handed further, to the next step or
+        to the database. A restarted pipeline picks up exactly the urls that were never completed.
+        Writes run in a thread, the lock serializes them over the single connection.
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS urls ("
+                "step INTEGER NOT NULL, "
+                "url TEXT NOT NULL, "
+                "completed INTEGER NOT NULL DEFAULT 0, "
+                "PRIMARY KEY (step, url)"
+                ") WITHOUT ROWID"
+            )
+            self.connection.execute("CREATE INDEX IF NOT EXISTS unfinished ON urls (step) WHERE completed = 0")
+
+    def __repr__(self):
+        return self.path.name
+
+    def _advance(self, step: int, sources: list[str], urls: list[str] | None = None) -> None:
+        # a single transaction, so a crash can't complete the sources without recording what came out of them
+        with self.lock, self.connection:
+            if urls:
+                self.connection.executemany(
+                    "INSERT OR IGNORE INTO urls (step, url) VALUES (?, ?)",
+                    [(step + 1, url) for url in urls]
+                )
+            if sources:
+                self.connection.executemany(
+                    "UPDATE urls SET completed = 1 WHERE step = ? AND url = ?",
+                    [(step, url) for url in sources]
+                )
+
+    async def enqueue(self, step: int, urls: list[str]) -> None:
+        """
+        Records urls as pending for the given step.
+        """
+        await to_thread(self._advance, step - 1, list(), urls)
+
+    async def advance(self, step: int, sources: list[str], urls: list[str] | None = None) -> None:
+        """
+        :param step: the step that fetched the sources.
+        :param sources: urls the step is done with.
+        :param urls: urls extracted from the sources, recorded as pending for the following step.
+        """
+        await to_thread(self._advance, step, sources, urls)
+
+    def unfinished(self) -> dict[int, list[str]]:
+        with self.lock:
+            rows = self.connection.execute("SELECT step, url FROM urls WHERE completed = 0 ORDER BY step").fetchall()
+        result: dict[int, list[str]] = dict()
+        for step, url in rows:
+            result.setdefault(step, list()).append(url)
+        return result
+
+    def seen(self) -> Iterator[tuple[int, str]]:
+        with self.lock:
+            rows = self.connection.execute("SELECT step, url FROM urls").fetchall()
+        return iter(rows)
+
+    def has_state(self) -> bool:
+        with self.lock:
+            return self.connection.execute("SELECT 1 FROM urls LIMIT 1").fetchone() is not None
+
+    def is_complete(self) -> bool:
+        with self.lock:
+            return self.connection.execute("SELECT 1 FROM urls WHERE completed = 0 LIMIT 1").fetchone() is None
+
+    def reset(self) -> None:
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM urls")
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
+
+    def remove(self) -> None:
+        """
+        Closes the checkpoint and deletes its files, called once a pipeline finished for good.
+        """
+        self.close()
+        for suffix in ["", "-wal", "-shm"]:
+            Path(f"{self.path}{suffix}").unlink(missing_ok=True)
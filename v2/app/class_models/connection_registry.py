@@ -0,0 +1,63 @@
+from aiohttp import ClientTimeout, ClientSession, TCPConnector
+
+from .rate_limiter import MAX_CONCURRENCY
+
+# ceiling for all connections opened by the engine
+GLOBAL_CONNECTION_LIMIT = 256
+# ceiling for connections to a single host, matches the highest concurrency a host limiter can reach
+HOST_CONNECTION_LIMIT = MAX_CONCURRENCY
+# idle keep-alive connections are kept this long so the next step or pipeline can pick them up
+KEEPALIVE_TIMEOUT = 60
+DNS_CACHE_TTL = 300
+
+
+class ConnectionRegistry:
+
+    def __init__(
+            self,
+            limit: int = GLOBAL_CONNECTION_LIMIT,
+            limit_per_host: int = HOST_CONNECTION_LIMIT,
+            trust_env: bool = True,
+            timeout: float | None = None
+    ) -> None:
+        """
+        Engine wide owner of the connection pool. All Scrapers get their sessions from here,
+        the sessions differ only in headers and share a single TCPConnector, so DNS lookups,
+        TLS handshakes and keep-alive connections are reused across steps and pipelines
+        targeting the same host.
+        The connector is created lazily since it needs a running event loop.
+        """
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.trust_env = trust_env
+        self.timeout = timeout
+        self._connector: TCPConnector | None = None
+
+    @property
+    def connector(self) -> TCPConnector:
+        if self._connector is None or self._connector.closed:
+            self._connector = TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=DNS_CACHE_TTL
+            )
+        return self._connector
+
+    def get_session(self, headers: dict) -> ClientSession:
+        """
+        Returns a new session on top of the shared connector. Closing the session leaves the connector,
+        and with it the pooled connections, open.
+        """
+        return ClientSession(
+            headers=headers,
+            connector=self.connector,
+            connector_owner=False,
+            trust_env=self.trust_env,
+            timeout=ClientTimeout(total=self.timeout)
+        )
+
+    async def close(self) -> None:
+        if self._connector is not None:
+            await self._connector.close()
+        self._connector = None
@@ -0,0 +1,98 @@
+import os
+import pickle
+from collections import OrderedDict
+from hashlib import blake2b
+from pathlib import Path
+from threading import Lock
+from uuid import uuid4
+
+
+class ExtractionCache:
+
+    def __init__(self, capacity: int, path: str | Path | None = None):
+        """
+        :param capacity: entries kept in memory, the least recently used one is evicted first. 0 disables it.
+        :param path: directory of the optional on-disk tier, created if missing. It outlives the process,
+        so identical pages of the next run are extracted from it as well.
+        Cache of extraction results keyed by (ExtractionPlan.version, hash of the page).
+        A byte-identical page extracted by an unchanged plan gets its previous records back without being parsed.
+        Records are stored pickled, so every hit returns fresh objects the caller is free to modify, and of the very
+        types the post processors returned, datetimes and tuples included.
+        Each extraction worker has its own, it's never shared between processes. The worker's extraction threads
+        do share it, the lock keeps the LRU consistent, disk access happens outside of it.
+        """
+        self.capacity = capacity
+        self.path = Path(path) if path is not None else None
+        if self.path is not None:
+            self.path.mkdir(parents=True, exist_ok=True)
+        self.entries: OrderedDict[str, bytes] = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return f"{len(self.entries)}/{self.capacity} entries, hit rate {self.hit_rate:.1%}"
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.disk_hits + self.misses
+        return (self.hits + self.disk_hits) / lookups if lookups else 0.0
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"hits": self.hits, "disk_hits": self.disk_hits, "misses": self.misses, "entries": len(self.entries)}
+
+    @staticmethod
+    def key(version: str, page: str) -> str:
+        return f"{version}-{blake2b(page.encode(errors='replace'), digest_size=16).hexdigest()}"
+
+    def _file(self, key: str) -> Path:
+        return self.path / key[-2:] / f"{key}.pickle"
+
+    def _remember(self, key: str, entry: bytes) -> None:
+        # expects self.lock to be held
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def get(self, key: str) -> list[dict] | None:
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+        if entry is not None:
+            return pickle.loads(entry)
+        if self.path is not None:
+            try:
+                entry = self._file(key).read_bytes()
+                records = pickle.loads(entry)
+            except (FileNotFoundError, pickle.UnpicklingError, EOFError):
+                pass
+            else:
+                with self.lock:
+                    self._remember(key, entry)
+                    self.disk_hits += 1
+                return records
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, records: list[dict]) -> None:
+        try:
+            entry = pickle.dumps(records, protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            # a post processor produced something that doesn't pickle, such records aren't cached
+            return
+        if self.capacity > 0:
+            with self.lock:
+                self._remember(key, entry)
+        if self.path is not None:
+            file = self._file(key)
+            file.parent.mkdir(exist_ok=True)
+            temporary = file.parent / f"{file.stem}.{uuid4().hex}.tmp"
+            temporary.write_bytes(entry)
+            # atomic, a concurrent reader never sees a half written entry
+            os.replace(temporary, file)
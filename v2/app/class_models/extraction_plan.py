@@ -0,0 +1,51 @@
+from hashlib import sha1
+
+from .selector import CrowSelector, SelectorList
+
+
+class ExtractionPlan:
+
+    def __init__(self, pipeline_name: str, step_order_id: int, selectors: list[CrowSelector] | None):
+        """
+        :param selectors: selectors of the step, None withdraws the plan once the step is done.
+        Selectors of a single step, registered with SyncEngine once when the pipeline starts.
+        Packages only refer to it through Package.plan_id, instead of carrying the selectors themselves.
+        """
+        self.pipeline_name = pipeline_name
+        self.step_order_id = step_order_id
+        self.selectors = selectors
+        self.version = self._version(selectors) if selectors is not None else None
+        self._compiled: SelectorList | None = None
+
+    def __repr__(self):
+        return f"{self.pipeline_name}:{self.step_order_id}"
+
+    def __getstate__(self):
+        # only the raw selectors travel between processes, every process compiles its own
+        state = self.__dict__.copy()
+        state["_compiled"] = None
+        return state
+
+    @staticmethod
+    def _version(selectors: list[CrowSelector]) -> str:
+        """
+        Fingerprint of everything that decides what the selectors extract, it changes along with any of them.
+        """
+        definition = [
+            (
+                x.__class__.__name__, x.name, str(x.method), getattr(x.directive, "pattern", x.directive),
+                x.default_return, x.post_processor, bool(x.required)
+            )
+            for x in selectors
+        ]
+        return sha1(repr(definition).encode()).hexdigest()[:16]
+
+    @property
+    def plan_id(self) -> tuple[str, int]:
+        return self.pipeline_name, self.step_order_id
+
+    @property
+    def compiled(self) -> SelectorList:
+        if self._compiled is None:
+            self._compiled = SelectorList(self.selectors).split_selectors()
+        return self._compiled
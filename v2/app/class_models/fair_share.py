@@ -0,0 +1,141 @@
+from asyncio import Condition, Future, CancelledError, get_running_loop
+from collections import deque
+
+
+class FairShare:
+
+    def __init__(self, capacity: int, weights: dict[str, float]):
+        """
+        :param capacity: amount of slots shared by everyone.
+        :param weights: weight per name, shared with whoever registers pipelines. Unknown names weigh 1.
+        Weighted fair semaphore. A free slot goes to the waiting name holding the fewest slots relative
+        to its weight, so a name with a thousand waiting requests can't keep a small one from getting its share.
+        """
+        self.capacity = capacity
+        self.weights = weights
+        self.in_use = 0
+        self.usage: dict[str, int] = dict()
+        self.waiters: dict[str, deque[Future]] = dict()
+
+    def __repr__(self):
+        return f"{self.in_use}/{self.capacity} {self.usage}"
+
+    def _grant(self) -> None:
+        while self.in_use < self.capacity:
+            waiting = [name for name, futures in self.waiters.items() if futures]
+            if not waiting:
+                return
+            name = min(waiting, key=lambda x: self.usage.get(x, 0) / self.weights.get(x, 1.0))
+            future = self.waiters[name].popleft()
+            if future.done():
+                # cancelled while waiting
+                continue
+            self.in_use += 1
+            self.usage[name] = self.usage.get(name, 0) + 1
+            future.set_result(None)
+
+    async def acquire(self, name: str) -> None:
+        future = get_running_loop().create_future()
+        self.waiters.setdefault(name, deque()).append(future)
+        self._grant()
+        try:
+            await future
+        except CancelledError:
+            if future.done() and not future.cancelled():
+                # the slot was granted just before the cancellation arrived
+                self.release(name)
+            raise
+
+    def release(self, name: str) -> None:
+        self.in_use -= 1
+        self.usage[name] -= 1
+        if not self.usage[name] and not self.waiters.get(name):
+            self.usage.pop(name)
+            self.waiters.pop(name, None)
+        self._grant()
+
+    def client(self, name: str) -> "FairShareClient":
+        return FairShareClient(share=self, name=name)
+
+
+class FairShareClient:
+
+    def __init__(self, share: FairShare, name: str):
+        """
+        FairShare bound to a single name, handed to the Scrapers of a pipeline.
+        """
+        self.share = share
+        self.name = name
+
+    async def acquire(self) -> None:
+        await self.share.acquire(self.name)
+
+    def release(self) -> None:
+        self.share.release(self.name)
+
+
+class FairQueue:
+
+    def __init__(self, weights: dict[str, float], max_bytes: int | None = None):
+        """
+        :param weights: weight per pipeline name, unknown names weigh 1.
+        :param max_bytes: put waits while the queue holds this many bytes of pages (Package.charged).
+        A single package is always let into an empty queue, however big it is.
+        Drop-in for the AsyncQueue between pipelines and SyncEngine, with one FIFO per pipeline.
+        get serves the pipeline with the lowest virtual time, which grows by the number of pages served
+        divided by the pipeline's weight. Extraction capacity is thereby shared by weight, instead of
+        going to whichever pipeline managed to fill the queue first.
+        """
+        self.weights = weights
+        self.queues: dict[str, deque] = dict()
+        self.virtual_time: dict[str, float] = dict()
+        self.clock = 0.0
+        self.size = 0
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.condition = Condition()
+
+    def qsize(self) -> int:
+        return self.size
+
+    def full(self) -> bool:
+        return self.max_bytes is not None and self.size > 0 and self.bytes >= self.max_bytes
+
+    def empty(self) -> bool:
+        return self.size == 0
+
+    async def put(self, package) -> None:
+        name = package.pipeline_name
+        async with self.condition:
+            await self.condition.wait_for(lambda: not self.full())
+            if not self.queues.get(name):
+                # a pipeline coming back from idle starts at the current clock, it doesn't get to cash in the idle time
+                self.virtual_time[name] = max(self.virtual_time.get(name, 0.0), self.clock)
+            self.queues.setdefault(name, deque()).append(package)
+            self.size += 1
+            self.bytes += package.charged
+            # getters and putters share the condition, so everyone gets to check
+            self.condition.notify_all()
+
+    async def get(self):
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.size > 0)
+            name = min((x for x, queue in self.queues.items() if queue), key=lambda x: self.virtual_time[x])
+            package = self.queues[name].popleft()
+            self.size -= 1
+            self.bytes -= package.charged
+            self.condition.notify_all()
+            self.clock = self.virtual_time[name]
+            cost = max(len(package.data), 1) if isinstance(package.data, list) else 1
+            self.virtual_time[name] += cost / self.weights.get(name, 1.0)
+            if not self.queues[name]:
+                self.queues.pop(name)
+            return package
+
+    def forget(self, name: str) -> None:
+        """
+        Drops the bookkeeping of a pipeline that finished.
+        """
+        if not self.queues.get(name):
+            self.queues.pop(name, None)
+            self.virtual_time.pop(name, None)
@@ -0,0 +1,88 @@
+from asyncio import Event
+
+
+def page_bytes(pages: list) -> int:
+    # characters rather than encoded bytes, close enough and it doesn't cost an encode per page
+    return sum(len(page) for page in pages if isinstance(page, str))
+
+
+class Credit:
+
+    def __init__(self, pipeline_name: str, size: int):
+        """
+        Sent back by SyncEngine once it has extracted a package, returns the package's bytes to the CreditPool.
+        """
+        self.pipeline_name = pipeline_name
+        self.size = size
+
+
+class CreditPool:
+
+    def __init__(self, capacity: int):
+        """
+        :param capacity: bytes of pages allowed between the Scrapers and the end of extraction, across pipelines.
+        End-to-end flow control between the engines. A Scraper charges the pages of every package it hands on
+        and SyncEngine returns them with a Credit once the package has been extracted. While the charged bytes
+        are at capacity, Scrapers don't start new requests, so pages stop piling up in memory whenever
+        extraction or the database fall behind. Requests already in flight finish and get charged,
+        so the capacity may be overshot by a window's worth of pages, but never by more.
+        """
+        self.capacity = capacity
+        self.in_flight = 0
+        self.by_pipeline: dict[str, int] = dict()
+        # times a request had to wait for credits, tells whether fetching is held back by extraction
+        self.pauses = 0
+        self.open = Event()
+        self.open.set()
+
+    def __repr__(self):
+        return f"{self.in_flight}/{self.capacity} bytes in flight"
+
+    async def wait(self) -> None:
+        if not self.open.is_set():
+            self.pauses += 1
+            await self.open.wait()
+
+    def charge(self, name: str, size: int) -> None:
+        self.in_flight += size
+        self.by_pipeline[name] = self.by_pipeline.get(name, 0) + size
+        if self.in_flight >= self.capacity:
+            self.open.clear()
+
+    def release(self, credit: Credit) -> None:
+        self.in_flight -= credit.size
+        left = self.by_pipeline.get(credit.pipeline_name, 0) - credit.size
+        if left > 0:
+            self.by_pipeline[credit.pipeline_name] = left
+        else:
+            self.by_pipeline.pop(credit.pipeline_name, None)
+        if self.in_flight < self.capacity:
+            self.open.set()
+
+    def report(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "capacity": self.capacity,
+            "pauses": self.pauses,
+            "by_pipeline": dict(self.by_pipeline)
+        }
+
+    def client(self, name: str) -> "CreditClient":
+        return CreditClient(pool=self, name=name)
+
+
+class CreditClient:
+
+    def __init__(self, pool: CreditPool, name: str):
+        """
+        CreditPool bound to a single pipeline, handed to its Scrapers.
+        """
+        self.pool = pool
+        self.name = name
+
+    async def wait(self) -> None:
+        await self.pool.wait()
+
+    def charge(self, package) -> None:
+        package.charged = page_bytes(package.data)
+        self.pool.charge(self.name, package.charged)
@@ -0,0 +1,202 @@
+import ast
+import re
+from typing import Callable, Iterable, Iterator
+
+# a bare member name, as in $.items or ..price
+NAME = re.compile(r"[^.\[\]\s]+")
+# a single member of a bracket union: integer, 'quoted' or "quoted" name
+UNION_MEMBER = re.compile(r"""\s*(-?\d+|'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*")\s*(,|$)""")
+# marks a missing result, since None (json null) is a valid one
+_MISSING = object()
+
+Step = Callable[[Iterable], Iterator]
+
+
+def _key(name: str) -> Step:
+    def step(values):
+        for value in values:
+            if isinstance(value, dict) and name in value:
+                yield value[name]
+    return step
+
+
+def _index(index: int) -> Step:
+    def step(values):
+        for value in values:
+            if isinstance(value, list) and -len(value) <= index < len(value):
+                yield value[index]
+    return step
+
+
+def _slice(part: slice) -> Step:
+    def step(values):
+        for value in values:
+            if isinstance(value, list):
+                yield from value[part]
+    return step
+
+
+def _wildcard(values):
+    for value in values:
+        if isinstance(value, dict):
+            yield from value.values()
+        elif isinstance(value, list):
+            yield from value
+
+
+def _union(steps: list[Step]) -> Step:
+    def step(values):
+        for value in values:
+            for member in steps:
+                yield from member((value, ))
+    return step
+
+
+def _descendants(values):
+    for value in values:
+        yield value
+        if isinstance(value, dict):
+            yield from _descendants(value.values())
+        elif isinstance(value, list):
+            yield from _descendants(value)
+
+
+def _recursive(inner: Step) -> Step:
+    def step(values):
+        return inner(_descendants(values))
+    return step
+
+
+class JsonPath:
+
+    def __init__(self, expression: str):
+        """
+        :param expression: JSONPath, e.g. $.data.items[*].price, $..id, $.items[0:10:2]['name', 'id'].
+        Supports member names, quoted names, indices, negative indices, slices, unions of names or indices,
+        the * wildcard and .. recursive descent. The leading $ may be omitted.
+        Compiled once into a chain of steps, evaluating it is just walking the document through them.
+        Raises ValueError for an expression it doesn't understand.
+        """
+        self.expression = expression
+        self.steps = self._compile(expression.strip())
+
+    def __repr__(self):
+        return self.expression
+
+    def __reduce__(self):
+        # compiled steps are closures, which don't pickle. Every process compiles its own.
+        return compile_json_path, (self.expression, )
+
+    @classmethod
+    def from_keys(cls, keys: list | tuple) -> "JsonPath":
+        """
+        Path of plain keys and indices, the way json selectors used to be written: ["data", 0, "price"].
+        """
+        path = cls.__new__(cls)
+        path.expression = str(list(keys))
+        path.steps = [_index(key) if isinstance(key, int) else _key(str(key)) for key in keys]
+        return path
+
+    @staticmethod
+    def _bracket(content: str) -> Step:
+        content = content.strip()
+        if content == "*":
+            return _wildcard
+        if ":" in content:
+            try:
+                bounds = [int(x) if x.strip() else None for x in content.split(":")]
+            except ValueError:
+                raise ValueError(f"Invalid slice [{content}]")
+            if len(bounds) > 3:
+                raise ValueError(f"Invalid slice [{content}]")
+            return _slice(slice(*bounds))
+        members = list()
+        position = 0
+        while position < len(content):
+            match = UNION_MEMBER.match(content, position)
+            if match is None:
+                raise ValueError(f"Invalid selection [{content}]")
+            member = match.group(1)
+            members.append(_index(int(member)) if member[0] not in "'\"" else _key(ast.literal_eval(member)))
+            position = match.end()
+        if not members:
+            raise ValueError("Empty selection []")
+        return members[0] if len(members) == 1 else _union(members)
+
+    def _compile(self, expression: str) -> list[Step]:
+        if expression.startswith("$"):
+            expression = expression[1:]
+        elif expression and expression[0] not in ".[":
+            expression = "." + expression
+        steps = list()
+        position = 0
+        while position < len(expression):
+            recursive = expression.startswith("..", position)
+            if recursive or expression[position] == ".":
+                position += 2 if recursive else 1
+                if expression.startswith("*", position):
+                    step = _wildcard
+                    position += 1
+                elif recursive and expression.startswith("[", position):
+                    # ..[0] and the like, the bracket is compiled on the next pass
+                    steps.append(_recursive(lambda values: values))
+                    continue
+                else:
+                    match = NAME.match(expression, position)
+                    if match is None:
+                        raise ValueError(f"Expected a name at {position} in {self.expression}")
+                    step = _key(match.group())
+                    position = match.end()
+            elif expression[position] == "[":
+                end = self._closing_bracket(expression, position)
+                step = self._bracket(expression[position + 1:end])
+                position = end + 1
+            else:
+                raise ValueError(f"Unexpected {expression[position]!r} at {position} in {self.expression}")
+            steps.append(_recursive(step) if recursive else step)
+        return steps
+
+    def _closing_bracket(self, expression: str, start: int) -> int:
+        quote = None
+        position = start + 1
+        while position < len(expression):
+            char = expression[position]
+            if quote:
+                if char == "\\":
+                    position += 1
+                elif char == quote:
+                    quote = None
+            elif char in "'\"":
+                quote = char
+            elif char == "]":
+                return position
+            position += 1
+        raise ValueError(f"Unclosed [ at {start} in {self.expression}")
+
+    def _walk(self, document) -> Iterator:
+        values = (document, )
+        for step in self.steps:
+            values = step(values)
+        return iter(values)
+
+    def find(self, document) -> list:
+        return list(self._walk(document))
+
+    def first(self, document, default=None):
+        # generators all the way down, so this stops at the first match
+        value = next(self._walk(document), _MISSING)
+        return default if value is _MISSING else value
+
+
+def compile_json_path(directive: str) -> JsonPath:
+    """
+    Accepts both a JSONPath and a literal list of keys, which is how json selectors used to be written.
+    """
+    if directive.strip().startswith(("[", "(")):
+        try:
+            keys = ast.literal_eval(directive)
+        except (SyntaxError, ValueError):
+            keys = None
+        if isinstance(keys, (list, tuple)):
+            return JsonPath.from_keys(keys)
+    return JsonPath(directive)
@@ -1,19 +1,72 @@
-from .selector import CrowSelector, SelectorList
+import struct
+
+# bumped whenever the encoding below changes, a package encoded by another version is refused rather than misread
+WIRE_VERSION = 2
+# version, closed_inbound, step_order_id, charged, byte length of pipeline_name
+HEADER = struct.Struct("!B?iQI")
 
 
 class Package:
 
+    __slots__ = ("pipeline_name", "step_order_id", "data", "closed_inbound", "sources", "charged")
+
     def __init__(
             self,
             pipeline_name: str,
             step_order_id: int,
-            data: list,
-            selectors: list[CrowSelector] | None = None,
-            closed_inbound: bool = False
+            data,
+            closed_inbound: bool = False,
+            sources: list[str] | None = None
     ) -> None:
+        """
+        :param data: pages on the way to SyncEngine, a RowBatch, a list of urls or a REUSE string on the way back.
+        """
         self.pipeline_name = pipeline_name
         self.step_order_id = step_order_id
         self.data = data
-        self.selectors = SelectorList(selectors).split_selectors() if selectors is not None else None
         # closed_inbound refers to final item coming from a particular step
         self.closed_inbound = closed_inbound
+        # urls the data was fetched from, failed ones included. Once the package has been handed further,
+        # they are marked completed in the pipeline's checkpoint.
+        self.sources = sources
+        # bytes charged to the engine's CreditPool by the Scraper, SyncEngine returns them once it's done
+        self.charged = 0
+
+    def __repr__(self):
+        return f"Package({self.pipeline_name}, step {self.step_order_id}, closed {self.closed_inbound})"
+
+    def __reduce__(self):
+        # the versioned header carries the fields, the payload is left to whoever pickles the package,
+        # so the pages are pickled once instead of into bytes that are pickled all over again
+        return Package.decode, (self.encode(), self.data, self.sources)
+
+    @property
+    def plan_id(self) -> tuple[str, int]:
+        """
+        Refers to the ExtractionPlan SyncEngine extracts this package with, registered once per step.
+        """
+        return self.pipeline_name, self.step_order_id
+
+    def encode(self) -> bytes:
+        """
+        Fixed header followed by the pipeline name. The payload isn't part of it, post processors
+        may return any python object and it has to come back exactly as it was returned, see __reduce__.
+        """
+        name = self.pipeline_name.encode()
+        header = HEADER.pack(WIRE_VERSION, self.closed_inbound, self.step_order_id, self.charged, len(name))
+        return header + name
+
+    @classmethod
+    def decode(cls, encoded: bytes, data=None, sources: list[str] | None = None) -> "Package":
+        version, closed_inbound, step_order_id, charged, length = HEADER.unpack_from(encoded)
+        if version != WIRE_VERSION:
+            raise ValueError(f"Package encoded with wire version {version}, expected {WIRE_VERSION}")
+        package = cls(
+            pipeline_name=bytes(encoded[HEADER.size:HEADER.size + length]).decode(),
+            step_order_id=step_order_id,
+            data=data,
+            closed_inbound=closed_inbound,
+            sources=sources
+        )
+        package.charged = charged
+        return package
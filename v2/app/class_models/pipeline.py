@@ -1,10 +1,20 @@
-from asyncio import create_task, sleep
+from asyncio import create_task
 from abc import ABC, ABCMeta
 from .package import Package
 from .profile import Profile
 from .step import Scraper, AsyncQueue, AsyncEvent
+from .connection_registry import ConnectionRegistry
+from .rate_limiter import AdaptiveRateLimiter
+from .url_frontier import UrlFrontier
+from .checkpoint import PipelineCheckpoint
+from .fair_share import FairShareClient
+from .flow_control import CreditClient
+from .extraction_plan import ExtractionPlan
 from app.logger.crow_logger import logger
 
+# packages coming back from SyncEngine that may wait for distribution, AsyncEngine stops receiving beyond it
+INBOUND_QUEUE_SIZE = 100
+
 
 class Pipeline(ABC):
     __metaclass__ = ABCMeta
@@ -13,43 +23,90 @@ class Pipeline(ABC):
 
 class ScrapingPipeline(Pipeline):
 
-    def __init__(self, profile: Profile):
+    def __init__(self, profile: Profile, frontier: UrlFrontier | None = None):
         """
         :param profile: A profile that will be run through the engines
+        :param frontier: deduplicates urls passed between steps, a Bloom filter backed one by default.
         Pipeline class serves as a Wrapper around Profile class which includes its Scrapers [Steps].
         Besides this, it handles communication with the AsyncEngine and distribution
         of packages sent and received by it.
         """
         self.profile = profile
         self.scrapers: list[Scraper] = list()
-        self.general_inbound = AsyncQueue()
+        self.general_inbound = AsyncQueue(maxsize=INBOUND_QUEUE_SIZE)
         self.stop_distributing = AsyncEvent()
+        self.frontier = frontier if frontier is not None else UrlFrontier()
+        # opened by AsyncEngine.handle_pipeline, pipelines run without one simply can't be resumed
+        self.checkpoint: PipelineCheckpoint | None = None
 
     def __len__(self):
         return len(self.scrapers)
 
+    def depths(self) -> dict:
+        return {
+            "inbound": self.general_inbound.qsize(),
+            "steps": {x.name: x.inbound.qsize() if x.inbound is not None else 0 for x in self.scrapers}
+        }
+
+    @property
+    def priority(self) -> int:
+        return self.profile.priority
+
     def get_scraper_order_by_name(self, name: str):
         for scraper in self.scrapers:
             if scraper.name == name:
                 return scraper.pipeline_order_id
         return None
 
+    def extraction_plans(self) -> list[ExtractionPlan]:
+        return [
+            ExtractionPlan(
+                pipeline_name=self.profile.name,
+                step_order_id=scraper.pipeline_order_id,
+                selectors=scraper.selectors
+            ) for scraper in self.scrapers
+        ]
+
+    def resume(self) -> dict[int, list[str]]:
+        """
+        Returns urls left unfinished per step by a previous run of this pipeline and seeds the frontier
+        with every url that run had already seen. A checkpoint left by a run that finished everything is reset.
+        """
+        if self.checkpoint is None or not self.checkpoint.has_state():
+            return dict()
+        unfinished = self.checkpoint.unfinished()
+        if not unfinished:
+            self.checkpoint.reset()
+            return dict()
+        for step, url in self.checkpoint.seen():
+            self.frontier.seen.add(self.frontier.key(url=url, step_order_id=step))
+        logger.info(f"Resuming {self!r} from {self.checkpoint!r}: "
+                    f"{ {step: len(urls) for step, urls in unfinished.items()} } unfinished urls per step.")
+        return unfinished
+
     async def send_initial_packages(self):
         try:
-            await self.scrapers[0].inbound.put(
-                Package(
-                    pipeline_name=self.profile.name,
-                    step_order_id=0,
-                    data=[self.scrapers[0].initial_url],
-                    selectors=self.scrapers[0].selectors
+            unfinished = self.resume()
+            if not unfinished:
+                unfinished = {0: [self.scrapers[0].initial_url]}
+                if self.checkpoint is not None:
+                    await self.checkpoint.enqueue(step=0, urls=unfinished[0])
+            for step, urls in unfinished.items():
+                if step >= len(self.scrapers):
+                    logger.error(f"{self.checkpoint!r} holds urls for step {step}, but {self!r} has no such step.")
+                    continue
+                await self.scrapers[step].inbound.put(
+                    Package(
+                        pipeline_name=self.profile.name,
+                        step_order_id=max(step - 1, 0),
+                        data=urls
+                    )
                 )
-            )
             await self.scrapers[0].inbound.put(
                 Package(
                     pipeline_name=self.profile.name,
                     step_order_id=0,
                     data=list(),
-                    selectors=list(),
                     closed_inbound=True
                 )
             )
@@ -68,7 +125,22 @@ class ScrapingPipeline(Pipeline):
             # packages processed from the last step will go  to database within AsyncEngine class methods
             try:
                 assert package.step_order_id < len(self.scrapers) - 1
-                # send the data to the next scraper
+                # pagination and category pages tend to link the same items over and over,
+                # the next scraper only gets the urls it hasn't been sent before.
+                # REUSE packages carry a single string and closing packages carry nothing, both pass as they are.
+                if not package.closed_inbound:
+                    if isinstance(package.data, list):
+                        package.data = self.frontier.filter(urls=package.data,
+                                                            step_order_id=package.step_order_id + 1)
+                    if self.checkpoint is not None:
+                        await self.checkpoint.advance(
+                            step=package.step_order_id,
+                            sources=package.sources or list(),
+                            urls=package.data if isinstance(package.data, list) else None
+                        )
+                    if not package.data:
+                        continue
+                # send the data to the next scraper, closing packages carry the step that just finished as well
                 await self.scrapers[package.step_order_id + 1].inbound.put(package)
                 print(f"Package distributed to {self.scrapers[package.step_order_id + 1]}.")
             except AssertionError as err:
@@ -77,12 +149,27 @@ class ScrapingPipeline(Pipeline):
             except IndexError as err:
                 print("INDEX ERROR")
                 logger.error(err)
+            finally:
+                self.general_inbound.task_done()
+        logger.info(f"Frontier of {self!r} dropped {self.frontier.dropped} duplicate urls.")
         return
 
-    async def initiate(self, outbound: AsyncQueue, database: AsyncQueue):
+    async def initiate(
+            self,
+            outbound: AsyncQueue,
+            database: AsyncQueue,
+            connections: ConnectionRegistry,
+            limiter: AdaptiveRateLimiter | None = None,
+            fetch_slots: FairShareClient | None = None,
+            credits: CreditClient | None = None
+    ):
         """
         :param outbound: AsyncEngine.pipeline_outbound that will be sent to SyncEngine.
         :param database: AsyncQueue() that delivers results to the database.
+        :param connections: AsyncEngine.connections, the pool all Scrapers share their connections from.
+        :param limiter: AsyncEngine.limiter, the per-host rate limiters all Scrapers share.
+        :param fetch_slots: this pipeline's share of the engine wide fetch capacity.
+        :param credits: this pipeline's client of the engine's CreditPool.
         Starts the package distribution coroutine that will run until clean_scrapers is finished.
         Sets the package outbound destination of all steps to match the AsyncEngine.pipeline_outbound
         and runs them in order.
@@ -96,10 +183,15 @@ class ScrapingPipeline(Pipeline):
         for scraper in self.scrapers:
             scraper.inbound = AsyncQueue()
             scraper.outbound = outbound
+            scraper.session = connections.get_session(headers=scraper.headers)
+            if limiter is not None:
+                scraper.limiter = limiter
+            scraper.fetch_slots = fetch_slots
+            scraper.credits = credits
         print("Scrapers IO set.")
+        # scrapers simply wait on their inbound until the first package arrives, no need to stagger them
         for scraper in self.scrapers:
             _ = create_task(scraper.run())
-            await sleep(0.5)
         await self.send_initial_packages()
         print("Initial packages sent!")
         return
@@ -0,0 +1,146 @@
+import ast
+import re
+from string import Formatter
+from types import SimpleNamespace
+
+# the only builtins a post processor gets to see
+SAFE_BUILTINS = {
+    "abs": abs, "all": all, "any": any, "bool": bool, "dict": dict, "enumerate": enumerate, "filter": filter,
+    "float": float, "int": int, "isinstance": isinstance, "len": len, "list": list, "map": map, "max": max,
+    "min": min, "range": range, "reversed": reversed, "round": round, "set": set, "sorted": sorted, "str": str,
+    "sum": sum, "tuple": tuple, "zip": zip, "None": None, "True": True, "False": False
+}
+# modules available by name, regex is common enough when formatting urls and prices.
+# Only their functions are exposed, the modules themselves lead to sys through their own imports.
+SAFE_MODULES = {
+    "re": SimpleNamespace(
+        search=re.search, match=re.match, fullmatch=re.fullmatch, findall=re.findall, split=re.split,
+        sub=re.sub, escape=re.escape, compile=re.compile, IGNORECASE=re.IGNORECASE, DOTALL=re.DOTALL
+    )
+}
+# name of the extracted value within an expression, it's a single value or a list, depending on the method
+VALUE_NAME = "data"
+# name of the whole column of values within a batch expression, one value per page of the package
+COLUMN_NAME = "column"
+# expressions are limited to these nodes. No statements, imports, assignments or star-args.
+ALLOWED_NODES = (
+    ast.Expression, ast.Constant, ast.Name, ast.Load, ast.Store, ast.Attribute, ast.Subscript, ast.Slice,
+    ast.Call, ast.keyword, ast.IfExp, ast.BoolOp, ast.BinOp, ast.UnaryOp, ast.Compare,
+    ast.List, ast.Tuple, ast.Set, ast.Dict, ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp,
+    ast.comprehension, ast.Lambda, ast.arguments, ast.arg, ast.JoinedStr, ast.FormattedValue,
+    ast.operator, ast.boolop, ast.unaryop, ast.cmpop, ast.expr_context
+)
+# str.format can reach attributes through its replacement fields, which the whitelist above can't see.
+# It's allowed on a constant template whose fields don't, see is_plain_template, the way REUSE urls are built.
+# The rest lead from generators and lambdas to frames and code, and from there to the caller's globals.
+FORBIDDEN_ATTRIBUTES = {
+    "format", "format_map", "mro", "gi_frame", "gi_code", "gi_yieldfrom", "cr_frame", "cr_code", "ag_frame",
+    "ag_code", "f_back", "f_globals", "f_locals", "f_builtins", "f_code", "tb_frame", "tb_next"
+}
+
+
+def is_plain_template(template: str) -> bool:
+    """
+    Whether the replacement fields of a str.format template refer to the arguments only, by position or name,
+    without reaching into their attributes or items. Fields nested within format specs are checked as well.
+    """
+    try:
+        fields = list(Formatter().parse(template))
+    except ValueError:
+        return False
+    for _, field, spec, _ in fields:
+        if field is None:
+            continue
+        if "." in field or "[" in field:
+            return False
+        if spec and not is_plain_template(spec):
+            return False
+    return True
+
+
+def is_plain_format(node: ast.Attribute) -> bool:
+    # 'https://example.com/{}'.format(data), the template has to be right there to be checked
+    return (
+        node.attr == "format"
+        and isinstance(node.value, ast.Constant)
+        and isinstance(node.value.value, str)
+        and is_plain_template(node.value.value)
+    )
+
+
+class PostProcessor:
+
+    def __init__(self, source: str):
+        """
+        :param source: a python expression over `data`, the extracted value, e.g. data.strip().replace(",", "").
+        Alternatively over `column`, a list with the value of every page of a package, returning a list
+        of the same length. Such a batch expression runs once per package instead of once per page.
+        The expression is checked against a whitelist and compiled once, here.
+        It's evaluated without builtins other than SAFE_BUILTINS, names starting with an underscore are refused,
+        so it can't reach the interpreter internals through attributes such as __class__ either.
+        str.format is only allowed on a template written in the expression, with fields such as {} or {page}.
+        Raises ValueError if the expression isn't allowed.
+        """
+        self.source = source
+        self.batch = False
+        self.code = self._compile()
+
+    def __repr__(self):
+        return self.source
+
+    def __getstate__(self):
+        # code objects don't pickle, every process compiles its own
+        return {"source": self.source}
+
+    def __setstate__(self, state):
+        self.source = state["source"]
+        self.batch = False
+        self.code = self._compile()
+
+    def _compile(self):
+        try:
+            tree = ast.parse(self.source.strip(), mode="eval")
+        except SyntaxError as err:
+            raise ValueError(f"Post processor {self.source!r} is not a valid expression: {err.msg}")
+        bound = set()
+        names = set()
+        for node in ast.walk(tree):
+            if not isinstance(node, ALLOWED_NODES):
+                raise ValueError(f"Post processor {self.source!r} may not contain {type(node).__name__}.")
+            if isinstance(node, ast.Attribute) and (node.attr.startswith("_") or node.attr in FORBIDDEN_ATTRIBUTES) \
+                    and not is_plain_format(node):
+                raise ValueError(f"Post processor {self.source!r} may not access {node.attr}.")
+            if isinstance(node, ast.Name):
+                if node.id.startswith("_"):
+                    raise ValueError(f"Post processor {self.source!r} may not access {node.id}.")
+                if isinstance(node.ctx, ast.Store):
+                    bound.add(node.id)
+                else:
+                    names.add(node.id)
+            if isinstance(node, ast.arg):
+                bound.add(node.arg)
+        unknown = names - bound - set(SAFE_BUILTINS) - set(SAFE_MODULES) - {VALUE_NAME, COLUMN_NAME}
+        if unknown:
+            raise ValueError(f"Post processor {self.source!r} refers to unknown names: {sorted(unknown)}")
+        if VALUE_NAME in names and COLUMN_NAME in names:
+            raise ValueError(f"Post processor {self.source!r} may use either {VALUE_NAME} or {COLUMN_NAME}.")
+        self.batch = COLUMN_NAME in names
+        return compile(tree, "<post_processor>", "eval")
+
+    def _evaluate(self, name: str, value):
+        # the value goes into globals, comprehensions and lambdas don't see the locals of eval
+        return eval(self.code, {"__builtins__": SAFE_BUILTINS, **SAFE_MODULES, name: value})
+
+    def __call__(self, data: str | list):
+        return self._evaluate(VALUE_NAME, data)
+
+    def apply_column(self, column: list) -> list:
+        """
+        Post processes the values of every page of a package at once.
+        """
+        if not self.batch:
+            return [self(value) for value in column]
+        processed = self._evaluate(COLUMN_NAME, column)
+        if not isinstance(processed, (list, tuple)) or len(processed) != len(column):
+            raise ValueError(f"Post processor {self.source!r} must return a value for each of {len(column)} pages.")
+        return list(processed)
@@ -4,13 +4,15 @@ from typing import Self
 
 class Profile:
 
-    def __init__(self, name: str, burst_rate: int, headers: dict, cookies: dict):
+    def __init__(self, name: str, burst_rate: int, headers: dict, cookies: dict, priority: int = 1):
         self.name = name
         self.headers = headers
         self.cookies = cookies
         self.created_at = datetime.now()
         self.crawl_history: list[datetime] = list()
         self.burst_rate = burst_rate
+        # weight of the pipeline in admission and in sharing the engine's fetch and extraction capacity
+        self.priority = priority
 
     def __repr__(self):
         return self.name
@@ -18,4 +20,5 @@ class Profile:
     def migrate_profile(self, profile: Self) -> None:
         self.headers = profile.headers
         self.cookies = profile.cookies
-        self.burst_rate = profile.burst_rate
\ No newline at end of file
+        self.burst_rate = profile.burst_rate
+        self.priority = profile.priority
\ No newline at end of file
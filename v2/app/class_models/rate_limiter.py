@@ -0,0 +1,174 @@
+from asyncio import Condition, wait_for
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from time import monotonic
+from urllib.parse import urlsplit
+
+# responses with these codes mean the host wants us to slow down
+THROTTLE_CODES = [429, 503]
+# additive increase: requests per second added on every successful response
+RATE_INCREASE = 0.5
+# multiplicative decrease: rate and concurrency are multiplied by this on every throttle signal
+DECREASE_FACTOR = 0.5
+# a response slower than LATENCY_TOLERANCE times the smoothed latency counts as a throttle signal
+LATENCY_TOLERANCE = 3.0
+# weight of the newest sample in the smoothed latency
+LATENCY_SMOOTHING = 0.1
+MIN_RATE = 0.2
+# rate and concurrency a host starts at, unless whoever reaches it first brings its own
+INITIAL_RATE = 2
+MAX_RATE = 100.0
+MAX_CONCURRENCY = 64
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """
+    Retry-After is either a number of seconds or an HTTP date. Returns the number of seconds to wait.
+    """
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        moment = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return max((moment - datetime.now(tz=timezone.utc)).total_seconds(), 0.0)
+
+
+class HostRateLimiter:
+
+    def __init__(self, rate: float, concurrency: int, max_concurrency: int = MAX_CONCURRENCY):
+        """
+        :param rate: initial amount of requests per second.
+        :param concurrency: initial amount of concurrent requests.
+        Token bucket for a single host. Both the rate and the concurrency adapt with AIMD,
+        they grow slowly while the host answers fast and get halved once it starts to push back.
+        """
+        self.rate = float(rate)
+        self.concurrency = float(concurrency)
+        self.max_concurrency = max_concurrency
+        self.tokens = 1.0
+        self.updated = monotonic()
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.last_decrease = 0.0
+        self.latency: float | None = None
+        self.condition = Condition()
+
+    def __repr__(self):
+        return f"rate={self.rate:.2f}/s concurrency={int(self.concurrency)} in_flight={self.in_flight}"
+
+    def _refill(self, now: float) -> None:
+        # the bucket holds at most a second worth of tokens
+        self.tokens = min(max(self.rate, 1.0), self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self) -> float:
+        """
+        Waits for a free concurrency slot and a token. Returns the time the request was admitted at,
+        which is expected back in release.
+        """
+        async with self.condition:
+            while True:
+                now = monotonic()
+                self._refill(now)
+                timeout = self.blocked_until - now if self.blocked_until > now else None
+                if timeout is None and self.in_flight < int(self.concurrency):
+                    if self.tokens >= 1.0:
+                        self.tokens -= 1.0
+                        self.in_flight += 1
+                        return now
+                    timeout = (1.0 - self.tokens) / self.rate
+                try:
+                    # woken up either by release or once the next token / block expiry is due
+                    await wait_for(self.condition.wait(), timeout=timeout)
+                except TimeoutError:
+                    pass
+
+    async def release(
+            self,
+            started: float,
+            status: int | None,
+            retry_after: str | None = None,
+            sent: float | None = None
+    ) -> None:
+        """
+        :param started: value returned by acquire.
+        :param status: response status, None if the request failed without one.
+        :param retry_after: raw Retry-After header, if any.
+        :param sent: time the request actually went out, if it waited for anything else after acquire.
+        The latency is measured from it, waiting on the caller's side isn't the host being slow.
+        """
+        async with self.condition:
+            now = monotonic()
+            latency = now - (started if sent is None else sent)
+            self.in_flight -= 1
+            slow = self.latency is not None and latency > LATENCY_TOLERANCE * self.latency
+            if status is None or status in THROTTLE_CODES or slow:
+                # requests admitted before the last decrease were sent at the old rate,
+                # so they must not halve it again
+                if started >= self.last_decrease:
+                    self.rate = max(MIN_RATE, self.rate * DECREASE_FACTOR)
+                    self.concurrency = max(1.0, self.concurrency * DECREASE_FACTOR)
+                    self.last_decrease = now
+                delay = parse_retry_after(retry_after)
+                if delay is not None:
+                    self.blocked_until = max(self.blocked_until, now + delay)
+            else:
+                self.rate = min(MAX_RATE, self.rate + RATE_INCREASE)
+                # grows by one slot per window of successful requests
+                self.concurrency = min(self.max_concurrency, self.concurrency + 1.0 / self.concurrency)
+            if status is not None and not slow:
+                self.latency = latency if self.latency is None else \
+                    (1 - LATENCY_SMOOTHING) * self.latency + LATENCY_SMOOTHING * latency
+            self.condition.notify_all()
+
+
+class AdaptiveRateLimiter:
+
+    def __init__(
+            self,
+            rate: float = INITIAL_RATE,
+            concurrency: int = INITIAL_RATE,
+            max_concurrency: int = MAX_CONCURRENCY
+    ):
+        """
+        Keeps a HostRateLimiter per host. AsyncEngine shares a single one between the Scrapers of all pipelines,
+        so a host sees one rate however many steps target it and its AIMD reacts to all of their requests.
+        A host starts with the rate given by the first request to reach it, or with the limiter's own.
+        """
+        self.rate = rate
+        self.concurrency = concurrency
+        self.max_concurrency = max_concurrency
+        self.hosts: dict[str, HostRateLimiter] = dict()
+
+    def get_host(self, url: str, rate: float | None = None) -> HostRateLimiter:
+        host = urlsplit(url).netloc
+        if host not in self.hosts:
+            self.hosts[host] = HostRateLimiter(
+                rate=self.rate if rate is None else rate,
+                concurrency=self.concurrency if rate is None else rate,
+                max_concurrency=self.max_concurrency
+            )
+        return self.hosts[host]
+
+    async def acquire(self, url: str, rate: float | None = None) -> float:
+        """
+        :param rate: starting rate and concurrency of the host, used only if it's the first request to reach it.
+        """
+        return await self.get_host(url, rate=rate).acquire()
+
+    async def release(
+            self,
+            url: str,
+            started: float,
+            status: int | None,
+            retry_after: str | None = None,
+            sent: float | None = None
+    ) -> None:
+        await self.get_host(url).release(started=started, status=status, retry_after=retry_after, sent=sent)
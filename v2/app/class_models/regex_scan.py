@@ -0,0 +1,103 @@
+import re
+
+# patterns are merged only when they start with this many literal characters in common. re factors the shared
+# prefix out of the alternation and scans for it as fast as for a single pattern, without one the merged
+# pattern is tried at every position of the page, which is slower than scanning once per pattern.
+MIN_SHARED_PREFIX = 4
+# characters that end the literal prefix of a pattern
+SPECIAL_CHARS = set(".^$*+?{}[]\\|()")
+# these refer to groups by number or name, which no longer holds once the pattern is part of an alternation
+GROUP_REFERENCES = re.compile(r"\\[1-9]|\(\?P=|\(\?\(")
+# flags of a pattern compiled without any
+DEFAULT_FLAGS = re.compile("").flags
+
+
+def literal_prefix(pattern: re.Pattern) -> str:
+    prefix = list()
+    for char in pattern.pattern:
+        if char in SPECIAL_CHARS:
+            # a quantifier applies to the last literal
+            if char in "*+?{" and prefix:
+                prefix.pop()
+            break
+        prefix.append(char)
+    return "".join(prefix)
+
+
+def is_mergeable(pattern: re.Pattern) -> bool:
+    return pattern.flags == DEFAULT_FLAGS and not GROUP_REFERENCES.search(pattern.pattern)
+
+
+class RegexScan:
+
+    def __init__(self, patterns: list[re.Pattern]):
+        """
+        Finds the first match of several patterns in one pass over the page, instead of one search per pattern.
+        The patterns are joined into a single alternation, whose search stops at the first position where any
+        of them matches. Every pattern still looking for its match is tried right there with its own match(),
+        which is exactly what its own search() would have found, groups included. Patterns that found theirs
+        are dropped from the alternation and the scan carries on from the next position.
+        """
+        self.patterns = patterns
+        # merged pattern per set of patterns still looking, compiled once and reused for every page
+        self.merged: dict[tuple[int, ...], re.Pattern] = dict()
+
+    def __repr__(self):
+        return f"RegexScan({len(self.patterns)} patterns)"
+
+    def _merged(self, pending: tuple[int, ...]) -> re.Pattern:
+        merged = self.merged.get(pending)
+        if merged is None:
+            merged = re.compile("|".join(f"(?:{self.patterns[index].pattern})" for index in pending))
+            self.merged[pending] = merged
+        return merged
+
+    def search(self, text: str) -> list[re.Match | None]:
+        """
+        :return: the first match of every pattern, in order, the same as [x.search(text) for x in self.patterns].
+        """
+        found: list[re.Match | None] = [None] * len(self.patterns)
+        pending = tuple(range(len(self.patterns)))
+        position = 0
+        merged = self._merged(pending)
+        while pending:
+            hit = merged.search(text, position)
+            if hit is None:
+                break
+            start = hit.start()
+            for index in pending:
+                found[index] = self.patterns[index].match(text, start)
+            remaining = tuple(index for index in pending if found[index] is None)
+            if remaining and remaining != pending:
+                merged = self._merged(remaining)
+            pending = remaining
+            position = start + 1
+        return found
+
+
+def plan_regex_scans(patterns: list[re.Pattern]) -> tuple[list[list[int]], list[int]]:
+    """
+    Groups first-match patterns that are worth scanning together.
+    :return: groups of indices to be merged into a RegexScan each, and indices left to search on their own.
+    """
+    groups: dict[str, list[int]] = dict()
+    single: list[int] = list()
+    for index, pattern in enumerate(patterns):
+        prefix = literal_prefix(pattern)
+        if len(prefix) < MIN_SHARED_PREFIX or not is_mergeable(pattern):
+            single.append(index)
+            continue
+        groups.setdefault(prefix[:MIN_SHARED_PREFIX], list()).append(index)
+    merged = list()
+    for indices in groups.values():
+        if len(indices) < 2:
+            single.extend(indices)
+            continue
+        try:
+            # duplicate group names across patterns, for one, don't survive being merged
+            re.compile("|".join(f"(?:{patterns[index].pattern})" for index in indices))
+        except re.error:
+            single.extend(indices)
+            continue
+        merged.append(indices)
+    return merged, sorted(single)
@@ -0,0 +1,72 @@
+import os
+from asyncio import to_thread
+from hashlib import sha1
+from pathlib import Path
+from uuid import uuid4
+
+import orjson
+
+
+class CachedResponse:
+
+    def __init__(self, body: str, etag: str | None = None, last_modified: str | None = None):
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+
+    def conditional_headers(self) -> dict:
+        """
+        Validators sent along a recrawl, the server answers with 304 if the page hasn't changed.
+        """
+        headers = dict()
+        if self.etag is not None:
+            headers["If-None-Match"] = self.etag
+        if self.last_modified is not None:
+            headers["If-Modified-Since"] = self.last_modified
+        return headers
+
+
+class ResponseCache:
+
+    def __init__(self, path: str | Path):
+        """
+        :param path: directory the responses are stored in, created if missing.
+        On-disk cache of response bodies keyed by url. Only responses carrying an ETag or Last-Modified
+        header are stored, since without validators they can't be revalidated on a recrawl.
+        Disk access runs in a thread in order to keep the event loop free.
+        """
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+
+    def _file(self, url: str) -> Path:
+        key = sha1(url.encode()).hexdigest()
+        return self.path / key[:2] / f"{key}.json"
+
+    def _read(self, url: str) -> CachedResponse | None:
+        try:
+            entry = orjson.loads(self._file(url).read_bytes())
+        except (FileNotFoundError, orjson.JSONDecodeError):
+            return None
+        return CachedResponse(**entry)
+
+    def _write(self, url: str, response: CachedResponse) -> None:
+        file = self._file(url)
+        file.parent.mkdir(exist_ok=True)
+        temporary = file.parent / f"{file.stem}.{uuid4().hex}.tmp"
+        temporary.write_bytes(orjson.dumps(
+            {"body": response.body, "etag": response.etag, "last_modified": response.last_modified}
+        ))
+        # atomic, a concurrent reader never sees a half written entry
+        os.replace(temporary, file)
+
+    async def get(self, url: str) -> CachedResponse | None:
+        return await to_thread(self._read, url)
+
+    async def put(self, url: str, body: str, headers) -> None:
+        """
+        :param headers: response headers, the validators are taken from them.
+        """
+        etag, last_modified = headers.get("ETag"), headers.get("Last-Modified")
+        if etag is None and last_modified is None:
+            return
+        await to_thread(self._write, url, CachedResponse(body=body, etag=etag, last_modified=last_modified))
@@ -0,0 +1,84 @@
+from heapq import heappush, heappop
+from random import uniform
+from time import monotonic
+
+# responses with these codes are worth another attempt, anything else not in ACCEPTABLE_CODES is final
+RETRY_CODES = [408, 429, 500, 502, 503, 504]
+# attempts a url gets in total, the first one included
+MAX_ATTEMPTS = 4
+# backoff before the n-th retry is drawn from [0, BASE_DELAY * 2 ** (n - 1)], capped at MAX_DELAY
+BASE_DELAY = 1.0
+MAX_DELAY = 60.0
+
+
+class RetryableFetchError(Exception):
+    """
+    Raised by Scraper._fetch for responses that are expected to succeed on a later attempt.
+    """
+
+    def __init__(self, url: str, status: int):
+        super().__init__(f"{url} responded with {status}")
+        self.url = url
+        self.status = status
+
+
+class RetryQueue:
+
+    def __init__(self, max_attempts: int = MAX_ATTEMPTS, base_delay: float = BASE_DELAY, max_delay: float = MAX_DELAY):
+        """
+        Holds failed urls of a single Scraper until their backoff expires.
+        Backoff is exponential with full jitter, so urls that failed together don't come back together.
+        Nothing here sleeps, the Scraper polls ready() and keeps fetching everything else in the meantime.
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.attempts: dict[str, int] = dict()
+        self.delayed: list[tuple[float, str]] = list()
+        self.retried = 0
+        self.exhausted = 0
+
+    def __len__(self):
+        return len(self.delayed)
+
+    def __repr__(self):
+        return f"waiting={len(self)} retried={self.retried} exhausted={self.exhausted}"
+
+    def schedule(self, url: str) -> bool:
+        """
+        Registers a failed attempt. Returns False once the url ran out of attempts and has been dropped.
+        """
+        attempt = self.attempts.get(url, 1)
+        if attempt >= self.max_attempts:
+            self.attempts.pop(url, None)
+            self.exhausted += 1
+            return False
+        self.attempts[url] = attempt + 1
+        delay = uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        heappush(self.delayed, (monotonic() + delay, url))
+        self.retried += 1
+        return True
+
+    def succeeded(self, url: str) -> None:
+        self.attempts.pop(url, None)
+
+    def ready(self) -> list[str]:
+        """
+        Pops all urls whose backoff has expired.
+        """
+        now = monotonic()
+        urls = list()
+        while self.delayed and self.delayed[0][0] <= now:
+            urls.append(heappop(self.delayed)[1])
+        return urls
+
+    def next_due(self) -> float | None:
+        """
+        Seconds until the next url is ready, None if nothing is waiting.
+        """
+        if not self.delayed:
+            return None
+        return max(self.delayed[0][0] - monotonic(), 0.0)
+
+    def report(self) -> dict:
+        return {"retried": self.retried, "exhausted": self.exhausted, "waiting": len(self)}
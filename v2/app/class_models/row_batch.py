@@ -0,0 +1,65 @@
+from typing import Iterator
+
+
+class RowBatch:
+
+    __slots__ = ("columns", "values")
+
+    def __init__(self, columns: tuple[str, ...], values: list[list]):
+        """
+        :param columns: column names, stored once for the whole batch.
+        :param values: one list per column, all of the same length.
+        Extracted records laid out by column, the way SyncEngine sends them back once a package is extracted.
+        Records of a single ExtractionPlan share their keys, so repeating every name for every row is dead weight,
+        both when pickled and when inserted. Iterating over it still yields one dict per row for whoever
+        expects the records themselves.
+        """
+        self.columns = columns
+        self.values = values
+
+    def __repr__(self):
+        return f"RowBatch({len(self)} rows x {len(self.columns)} columns)"
+
+    def __len__(self):
+        return len(self.values[0]) if self.values else 0
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __eq__(self, other):
+        if not isinstance(other, RowBatch):
+            return NotImplemented
+        return self.columns == other.columns and self.values == other.values
+
+    def __iter__(self) -> Iterator[dict]:
+        for row in self.rows():
+            yield dict(zip(self.columns, row))
+
+    def __getitem__(self, index: int) -> dict:
+        return {name: column[index] for name, column in zip(self.columns, self.values)}
+
+    def __getstate__(self):
+        return self.columns, self.values
+
+    def __setstate__(self, state):
+        self.columns, self.values = state
+
+    def rows(self) -> Iterator[tuple]:
+        return zip(*self.values)
+
+    @classmethod
+    def from_records(cls, records: list[dict]) -> "RowBatch":
+        """
+        Columns appear in the order their names first appear in, a record missing one of them gets None there.
+        """
+        columns: dict[str, None] = dict()
+        for record in records:
+            if record.keys() != columns.keys():
+                columns.update(dict.fromkeys(record))
+        names = tuple(columns)
+        values = [[record.get(name) for record in records] for name in names]
+        return cls(columns=names, values=values)
+
+
+def is_records(data) -> bool:
+    return isinstance(data, list) and bool(data) and all(isinstance(item, dict) for item in data)
@@ -1,9 +1,106 @@
 from abc import ABC, ABCMeta, abstractmethod
 import re
 import parsel
-import ast
 import json
+import orjson
+from functools import lru_cache
+from threading import local
+from cssselect import SelectorError
+from lxml import etree
+from parsel.csstranslator import css2xpath
 from app.utils.case_insensitive_enums import SelectorMethod
+from app.logger.crow_logger import logger
+from .post_processor import PostProcessor
+from .json_path import JsonPath, compile_json_path
+from .regex_scan import RegexScan, plan_regex_scans
+
+# same extensions parsel makes available to its xpath queries
+XPATH_NAMESPACES = {
+    "re": "http://exslt.org/regular-expressions",
+    "set": "http://exslt.org/sets"
+}
+# marks a representation that hasn't been parsed yet, since None is a valid parse result
+_UNPARSED = object()
+
+
+class Document:
+
+    def __init__(self, text: str):
+        """
+        A single page, shared by all selectors extracting from it.
+        Every representation is parsed the first time a selector asks for it and never again,
+        a page without xpath selectors is never parsed into a tree, one without json selectors never loaded.
+        """
+        self.text = text
+        self._tree = _UNPARSED
+        self._json = _UNPARSED
+
+    @property
+    def tree(self):
+        """
+        lxml root of the page, parsed the way parsel does it. None if the page can't be parsed.
+        """
+        if self._tree is _UNPARSED:
+            try:
+                self._tree = parsel.Selector(text=self.text).root
+            except (ValueError, TypeError, etree.LxmlError) as err:
+                logger.error(err)
+                self._tree = None
+        return self._tree
+
+    @property
+    def json(self):
+        """
+        Loaded json document. None if the page isn't valid json.
+        """
+        if self._json is _UNPARSED:
+            try:
+                self._json = orjson.loads(self.text)
+            except orjson.JSONDecodeError:
+                # orjson refuses a few things the standard library accepts, NaN and Infinity among them
+                try:
+                    self._json = json.loads(self.text)
+                except ValueError:
+                    self._json = None
+            except TypeError:
+                self._json = None
+        return self._json
+
+
+def xpath_result_to_str(result) -> str:
+    """
+    Stringifies a single xpath result the same way parsel's Selector.get does.
+    """
+    if isinstance(result, str):
+        return str(result)
+    if result is True:
+        return "1"
+    if result is False:
+        return "0"
+    try:
+        return etree.tostring(result, method="html", encoding="unicode", with_tail=False)
+    except TypeError:
+        return str(result)
+
+
+def compile_xpath(directive: str) -> etree.XPath | None:
+    try:
+        return etree.XPath(directive, namespaces=XPATH_NAMESPACES, smart_strings=False)
+    except etree.XPathSyntaxError as err:
+        logger.error(f"Invalid xpath {directive}: {err}")
+        return None
+
+
+@lru_cache(maxsize=1024)
+def css_to_xpath(directive: str) -> str | None:
+    """
+    Translates a css selector into xpath, parsel's ::text and ::attr(name) pseudo-elements included.
+    """
+    try:
+        return css2xpath(directive)
+    except SelectorError as err:
+        logger.error(f"Invalid css selector {directive}: {err}")
+        return None
 
 
 class CrowSelector(ABC):
@@ -24,6 +121,7 @@ class CrowSelector(ABC):
         self.method = method
         self.default_return = default_return
         self.post_processor = post_processor
+        self.processor = self._compile_post_processor(post_processor)
         self.required = required
         self._name = None
 
@@ -31,25 +129,32 @@ class CrowSelector(ABC):
         return self.name
 
     @abstractmethod
-    def extract_all(self, data: str) -> list:
+    def extract_all(self, document: Document) -> list:
         pass
 
     @abstractmethod
-    def extract_first(self, data: str) -> str:
+    def extract_first(self, document: Document) -> str:
         pass
 
+    def _compile_post_processor(self, post_processor: str | None) -> PostProcessor | None:
+        if post_processor is None:
+            return None
+        try:
+            return PostProcessor(post_processor)
+        except ValueError as err:
+            # stored before post processors were checked, the raw values are extracted instead
+            logger.error(err)
+            return None
+
     def post_process(self, data: str | list):
-        if self.post_processor is None:
+        if self.processor is None:
             return data
-        formatted = eval(self.post_processor)
+        formatted = self.processor(data)
         return formatted
 
-    def extract(self, data) -> str | list:
-        if self.method == "first":
-            data = self.extract_first(data=data)
-        else:
-            data = self.extract_all(data=data)
-        if self.post_processor is not None:
+    def finish(self, data: str | list) -> str | list:
+        # batch post processors run over the whole package, see SelectorList.post_process_columns
+        if self.processor is not None and not self.processor.batch:
             try:
                 formatted = self.post_process(data)
                 return formatted
@@ -57,6 +162,13 @@ class CrowSelector(ABC):
                 print(err)
         return data
 
+    def extract(self, document: Document) -> str | list:
+        if self.method == "first":
+            data = self.extract_first(document=document)
+        else:
+            data = self.extract_all(document=document)
+        return self.finish(data)
+
 
 class RegexSelector(CrowSelector):
     def __init__(self,
@@ -75,20 +187,98 @@ class RegexSelector(CrowSelector):
         self.directive = re.compile(directive)
         self._name = "regex"
         
-    def extract_first(self, data: str) -> str:
+    def from_match(self, match: re.Match | None) -> str:
         try:
-            return re.search(pattern=self.directive, string=data).groups()[0]
+            return match.groups()[0]
         except (AttributeError, IndexError):
             return self.default_return
 
-    def extract_all(self, data: str) -> list:
+    def extract_first(self, document: Document) -> str:
         try:
-            return re.findall(pattern=self.directive, string=data)
+            return self.from_match(self.directive.search(document.text))
+        except TypeError:
+            return self.default_return
+
+    def extract_all(self, document: Document) -> list:
+        try:
+            return self.directive.findall(document.text)
         except (ValueError, TypeError):
             return list()
 
 
-class XpathSelector(CrowSelector):
+class TreeSelector(CrowSelector):
+
+    def __init__(self,
+                 name: str,
+                 directive: all,
+                 method=SelectorMethod.First,
+                 required: bool = False,
+                 default_return: str | None = None,
+                 post_processor: str | None = None):
+        """
+        Base of the selectors evaluated as xpath on the parsed tree of the page. Subclasses set self.xpath,
+        which is compiled once and evaluated either on the whole page or relative to a row container.
+        """
+        super(TreeSelector, self).__init__(name=name,
+                                           directive=directive,
+                                           method=method,
+                                           required=required,
+                                           default_return=default_return,
+                                           post_processor=post_processor)
+        self.xpath: str | None = None
+        self.compiled: etree.XPath | None = None
+
+    def compile(self) -> None:
+        self.compiled = compile_xpath(self.xpath) if self.xpath is not None else None
+        # lxml lets a single XPath object evaluate in one thread at a time, so every other thread compiles its own
+        self.threads = local()
+        self.threads.compiled = self.compiled
+
+    def __getstate__(self):
+        # compiled xpaths don't pickle, every process compiles its own
+        state = self.__dict__.copy()
+        state["compiled"] = None
+        state["threads"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.compile()
+
+    def select(self, node) -> list:
+        if self.compiled is None or node is None:
+            return list()
+        compiled = getattr(self.threads, "compiled", None)
+        if compiled is None:
+            compiled = self.threads.compiled = etree.XPath(
+                self.xpath, namespaces=XPATH_NAMESPACES, smart_strings=False
+            )
+        try:
+            result = compiled(node)
+        except etree.XPathError:
+            return list()
+        return result if isinstance(result, list) else [result]
+
+    def extract_first(self, document: Document) -> str:
+        return self.first_of(self.select(document.tree))
+
+    def extract_all(self, document: Document) -> list:
+        return [xpath_result_to_str(item) for item in self.select(document.tree)]
+
+    def first_of(self, result: list) -> str:
+        return xpath_result_to_str(result[0]) if result else self.default_return
+
+    def extract_node(self, node) -> str | list:
+        """
+        Extracts relative to a single element of the page, a row container.
+        """
+        result = self.select(node)
+        if self.method == "first":
+            return self.finish(self.first_of(result))
+        return self.finish([xpath_result_to_str(item) for item in result])
+
+
+class XpathSelector(TreeSelector):
 
     def __init__(self,
                  name: str,
@@ -104,31 +294,39 @@ class XpathSelector(CrowSelector):
                                             default_return=default_return,
                                             post_processor=post_processor)
         self._name = "xpath"
-    
-    def extract_first(self, p_selector: parsel.Selector) -> str:
-        try:
-            return p_selector.xpath(query=self.directive).get(default=self.default_return)
-        except ValueError:
-            return self.default_return
+        # compiled once here, instead of on every page
+        self.xpath = directive
+        self.compile()
 
-    def extract_all(self, p_selector: parsel.Selector) -> list:
-        try:
-            return p_selector.xpath(query=self.directive).getall()
-        except ValueError:
-            return list()
 
-    def extract(self, p_selector: parsel.Selector) -> str | list:
-        if self.method == "first":
-            data = self.extract_first(p_selector=p_selector)
-        else:
-            data = self.extract_all(p_selector=p_selector)
-        if self.post_processor is not None:
-            try:
-                formatted = self.post_process(data)
-                return formatted
-            except Exception as err:
-                print(err)
-        return data
+class RowSelector(TreeSelector):
+
+    def __init__(self,
+                 name: str,
+                 directive: all,
+                 method=SelectorMethod.All,
+                 required: bool = False,
+                 default_return: str | None = None,
+                 post_processor: str | None = None):
+        """
+        :param directive: xpath selecting the element of every record on the page, e.g. //li[@class="result"].
+        Turns a page into as many records as the directive selects elements, a listing or search results page
+        into one row per item. Every xpath and css selector of the step is evaluated relative to each of these
+        elements, so they should start with a dot: .//a/@href, not //a/@href. Css selectors are relative anyway.
+        Regex, json and static selectors are evaluated once per page and their values copied into every record.
+        """
+        super(RowSelector, self).__init__(name=name,
+                                          directive=directive,
+                                          method=method,
+                                          required=required,
+                                          default_return=default_return,
+                                          post_processor=post_processor)
+        self._name = "row"
+        self.xpath = directive
+        self.compile()
+
+    def containers(self, document: Document) -> list:
+        return [x for x in self.select(document.tree) if isinstance(x, etree._Element)]
 
 
 class JsonSelector(CrowSelector):
@@ -147,20 +345,24 @@ class JsonSelector(CrowSelector):
                                            default_return=default_return,
                                            post_processor=post_processor)
         self._name = "json"
-
-    def extract_first(self, data: str) -> str:
-        text = json.loads(data)
+        # compiled once here, instead of on every page
         try:
-            directives = ast.literal_eval(self.directive)
-            for item in directives:
-                text = text[item]
-
-            return text
-        except (KeyError, TypeError, SyntaxError, ValueError):
+            self.path: JsonPath | None = compile_json_path(directive)
+        except ValueError as err:
+            logger.error(f"Invalid json path {directive}: {err}")
+            self.path = None
+
+    def extract_first(self, document: Document) -> str:
+        text = document.json
+        if text is None or self.path is None:
             return self.default_return
+        return self.path.first(text, default=self.default_return)
 
-    def extract_all(self, data: str) -> list:
-        pass
+    def extract_all(self, document: Document) -> list:
+        text = document.json
+        if text is None or self.path is None:
+            return list()
+        return self.path.find(text)
 
 
 class StaticSelector(CrowSelector):
@@ -180,14 +382,14 @@ class StaticSelector(CrowSelector):
                                              post_processor=post_processor)
         self._name = "static"
 
-    def extract_first(self, data: str) -> str:
+    def extract_first(self, document: Document) -> str:
         return self.directive
 
-    def extract_all(self, data: str) -> list:
+    def extract_all(self, document: Document) -> list:
         return self.directive
 
 
-class CssSelector(CrowSelector):
+class CssSelector(TreeSelector):
 
     def __init__(self,
                  name: str,
@@ -203,18 +405,19 @@ class CssSelector(CrowSelector):
                                           default_return=default_return,
                                           post_processor=post_processor)
         self._name = "css"
-        
-    def extract_first(self, data: str) -> str:
-        pass
-
-    def extract(self, data) -> str | list:
-        pass
+        # translated and compiled once here, after which it costs exactly as much as an xpath selector
+        self.xpath = css_to_xpath(directive)
+        self.compile()
 
 
 class SelectorList:
 
     def __init__(self, selectors: list[CrowSelector]):
-        self.extracted = dict()
+        """
+        Selectors of a step, split by type once. Holds no state of its own during extraction,
+        every call parses into its own Document and returns a new dict, so a single SelectorList
+        can serve any number of threads at once.
+        """
         self.selectors: list[CrowSelector] = selectors
         self.regex_list: list[RegexSelector] = list()
         self.xpath_list: list[XpathSelector] = list()
@@ -222,6 +425,13 @@ class SelectorList:
         self.static_list: list[StaticSelector] = list()
         self.css_list: list[CssSelector] = list()
         self.required: list[CrowSelector] = list()
+        # turns every page into many records, see RowSelector
+        self.row: RowSelector | None = None
+        # every selector but the row container, the ones that make up a record
+        self.fields: list[CrowSelector] = list()
+        # first-match regex selectors that are searched for in a single pass, see RegexScan
+        self.regex_scans: list[tuple[RegexScan, list[RegexSelector]]] = list()
+        self.regex_single: list[RegexSelector] = list()
 
     def __getitem__(self, item):
         return self.selectors[item]
@@ -229,8 +439,20 @@ class SelectorList:
     def __len__(self):
         return len(self.selectors)
 
+    @property
+    def protocol(self) -> str:
+        # all selectors must have the same method, the row container aside.
+        # A row container on its own yields its records as they are, like the first method does.
+        return self.fields[0].method if self.fields else "first"
+
     def split_selectors(self):
         for selector in self.selectors:
+            if isinstance(selector, RowSelector):
+                if self.row is not None:
+                    raise LookupError(f"A step takes a single row selector, got {self.row} and {selector}.")
+                self.row = selector
+                continue
+            self.fields.append(selector)
             if selector.required:
                 self.required.append(selector)
             if isinstance(selector, RegexSelector):
@@ -248,37 +470,99 @@ class SelectorList:
                 self.css_list.append(selector)
             else:
                 raise LookupError
+        self.plan_regex()
         return self
 
-    def extract_regex(self, data):
+    def plan_regex(self) -> None:
+        first = [x for x in self.regex_list if x.method == "first"]
+        merged, single = plan_regex_scans([x.directive for x in first])
+        for indices in merged:
+            self.regex_scans.append((RegexScan([first[x].directive for x in indices]), [first[x] for x in indices]))
+        self.regex_single = [first[x] for x in single] + [x for x in self.regex_list if x.method != "first"]
+
+    def extract_regex(self, document: Document, values: dict) -> dict:
+        found = dict()
+        for selector in self.regex_single:
+            found[selector.name] = selector.extract(document=document)
+        if isinstance(document.text, str):
+            for scan, selectors in self.regex_scans:
+                for selector, match in zip(selectors, scan.search(document.text)):
+                    found[selector.name] = selector.finish(selector.from_match(match))
+        else:
+            for _, selectors in self.regex_scans:
+                for selector in selectors:
+                    found[selector.name] = selector.extract(document=document)
+        # keeps the order the selectors were given in
         for selector in self.regex_list:
-            self.extracted.update({selector.name: selector.extract(data=data)})
-        return self
+            values[selector.name] = found[selector.name]
+        return values
 
-    def extract_xpath(self, data):
-        p_selector = parsel.Selector(data)
+    def extract_xpath(self, document: Document, values: dict) -> dict:
         for selector in self.xpath_list:
-            self.extracted.update({selector.name: selector.extract(p_selector=p_selector)})
-        return self
+            values[selector.name] = selector.extract(document=document)
+        return values
 
-    def extract_css(self, data):
-        # not implemented yet
-        return self
+    def extract_css(self, document: Document, values: dict) -> dict:
+        for selector in self.css_list:
+            values[selector.name] = selector.extract(document=document)
+        return values
 
-    def extract_json(self, data):
+    def extract_json(self, document: Document, values: dict) -> dict:
         for selector in self.json_list:
-            self.extracted.update({selector.name: selector.extract(data=data)})
-        return self
+            values[selector.name] = selector.extract(document=document)
+        return values
 
-    def extract_static(self):
+    def extract_static(self, values: dict) -> dict:
         for selector in self.static_list:
-            self.extracted.update({selector.name: selector.directive})
-        return self
+            values[selector.name] = selector.directive
+        return values
 
-    def extract(self, data: str):
-        self.extracted.clear()
-        self.extract_regex(data).extract_xpath(data).extract_json(data).extract_static().extract_css(data)
+    def post_process_columns(self, rows: list[dict]) -> list[dict]:
+        """
+        Runs batch post processors, each over the column of its selector's values across all pages of a package.
+        """
+        for selector in self.selectors:
+            if selector.processor is None or not selector.processor.batch:
+                continue
+            try:
+                column = selector.processor.apply_column([row.get(selector.name) for row in rows])
+            except Exception as err:
+                print(err)
+                continue
+            for row, value in zip(rows, column):
+                row[selector.name] = value
+        return rows
+
+    def extract_rows(self, data: str) -> list[dict]:
+        """
+        Runs the selectors over the page once per row container, see RowSelector.
+        Records missing a required value are left out, a listing is bound to hold the odd ad or placeholder.
+        """
+        document = Document(text=data)
+        page = self.extract_static(self.extract_json(document, self.extract_regex(document, dict())))
+        records = list()
+        for container in self.row.containers(document):
+            values = {x.name: x.extract_node(container) for x in self.xpath_list + self.css_list}
+            record = {x.name: values[x.name] if x.name in values else page[x.name] for x in self.fields}
+            if any(record[x.name] is None for x in self.required):
+                continue
+            records.append(record)
+        return records
+
+    def extract(self, data: str) -> dict:
+        """
+        Runs every selector over the page. The page is wrapped into a single Document, so whatever
+        representation the selectors need is parsed once and shared between them.
+        :return: a new dict of values by selector name, the caller owns it.
+        """
+        document = Document(text=data)
+        values = dict()
+        self.extract_regex(document, values)
+        self.extract_xpath(document, values)
+        self.extract_json(document, values)
+        self.extract_static(values)
+        self.extract_css(document, values)
         for required in self.required:
-            if self.extracted[required.name] is None:
-                return {x: None for x in self.extracted}
-        return self.extracted
+            if values[required.name] is None:
+                return {x: None for x in values}
+        return values
@@ -1,12 +1,20 @@
 from abc import ABC, ABCMeta, abstractmethod
-from typing import Any, Self
-from aiohttp import ClientTimeout, ClientSession, TCPConnector
-from asyncio import Queue as AsyncQueue, Event as AsyncEvent, sleep, TaskGroup
+from contextlib import asynccontextmanager
+from typing import Any, Self, AsyncIterator
+from aiohttp import ClientTimeout, ClientSession, TCPConnector, ClientError
+from asyncio import Queue as AsyncQueue, Event as AsyncEvent, Task, sleep, gather, create_task, wait, FIRST_COMPLETED
+from collections import deque
+from time import monotonic
 
 from app.utils.split_to_batches import to_batches
 
 from .package import Package
 from .selector import CrowSelector
+from .rate_limiter import AdaptiveRateLimiter, MAX_CONCURRENCY
+from .response_cache import ResponseCache
+from .retry_queue import RetryQueue, RetryableFetchError, RETRY_CODES
+from .fair_share import FairShareClient
+from .flow_control import CreditClient
 
 from app.logger.crow_logger import logger
 
@@ -14,6 +22,14 @@ from app.logger.crow_logger import logger
 ACCEPTABLE_CODES = [200, 302]
 # batch length represents the amount of concurrently scrapped data
 BATCH_LENGTH = 200
+# streaming mode keeps this many requests in flight at all times
+STREAM_WINDOW = 200
+# streamed responses are flushed to outbound once this many are buffered...
+FLUSH_SIZE = BATCH_LENGTH
+# ...or once this many seconds passed since the last flush, whichever comes first
+FLUSH_INTERVAL = 5.0
+# failures that put a url back into the retry queue, anything else is logged and dropped
+RETRYABLE_ERRORS = (ClientError, TimeoutError, RetryableFetchError)
 
 
 class Step(ABC):
@@ -46,7 +62,9 @@ class Scraper(Step):
             pipeline_order_id: int,
             headers: dict,
             burst_rate: int,
-            initial_url: str | None = None
+            initial_url: str | None = None,
+            streaming: bool = True,
+            response_cache: ResponseCache | None = None
     ) -> None:
 
         self.name = name
@@ -55,14 +73,24 @@ class Scraper(Step):
         self.outbound: AsyncQueue | None = None
         self.initial_url = initial_url
         self.headers = headers
-        self.session = self.get_aiohttp_session(
-            headers=headers,
-            burst_rate=burst_rate,
-            trust_env=True,
-            timeout=None
-        )
+        # handed out by the engine's ConnectionRegistry in ScrapingPipeline.initiate,
+        # a Scraper run outside of an engine opens its own session in run
+        self.session: ClientSession | None = None
+        # burst_rate is only the starting point, every host's rate and concurrency adapt from there on
+        self.burst_rate = burst_rate
+        # replaced by the engine's in ScrapingPipeline.initiate, shared by every Scraper targeting the same host
+        self.limiter = AdaptiveRateLimiter(rate=burst_rate, concurrency=burst_rate)
         self.selectors: list[CrowSelector] = list()
         self.finished = AsyncEvent()
+        # streaming replaces the batch barrier, set to False to fall back to batch by batch scraping
+        self.streaming = streaming
+        # optional, when set, recrawls revalidate pages with conditional requests instead of refetching them
+        self.response_cache = response_cache
+        self.retries = RetryQueue()
+        # the pipeline's share of the engine wide fetch capacity, set in ScrapingPipeline.initiate
+        self.fetch_slots: FairShareClient | None = None
+        # the pipeline's credits for pages in flight towards extraction, set in ScrapingPipeline.initiate
+        self.credits: CreditClient | None = None
 
     def get_selector_id_by_name(self, name: str):
         for selector in range(len(self.selectors)):
@@ -73,13 +101,14 @@ class Scraper(Step):
     @staticmethod
     def get_aiohttp_session(
             headers: dict,
-            burst_rate: int = 2,
+            connection_limit: int = MAX_CONCURRENCY,
             trust_env: bool = False,
             timeout: float | None = None
     ) -> ClientSession:
 
         aiohttp_timeout = ClientTimeout(total=timeout)
-        aiohttp_connector = TCPConnector(limit=burst_rate)
+        # the connector limit is only a ceiling, actual throttling is done by the rate limiter
+        aiohttp_connector = TCPConnector(limit=connection_limit)
         client_session = ClientSession(
             headers=headers,
             connector=aiohttp_connector,
@@ -91,69 +120,234 @@ class Scraper(Step):
     async def scrape_single_package(self, package: Package) -> list:
         _urls: list[str] = package.data
         assert len(_urls) <= BATCH_LENGTH
-        return await self._scrape_batch(batch=_urls)
+        return [page for _, page in await self._scrape_batch(batch=_urls) if page is not None]
+
+    @asynccontextmanager
+    async def _slot(self, url: str) -> AsyncIterator[dict]:
+        """
+        Admits a request through the host's rate limiter first and the pipeline's fetch share second,
+        so requests held back by a throttled host don't sit on global capacity.
+        Before either, it waits for credits, no request starts while extraction is behind.
+        Yields a dict the request fills with the response status and Retry-After for the limiter.
+        The limiter measures the latency from the moment the fetch slot is granted, so waiting for the pipeline's
+        share doesn't count as the host slowing down. Nothing but the request itself belongs inside the slot.
+        """
+        if self.credits is not None:
+            await self.credits.wait()
+        # the limiter tells requests sent before and after its last decrease apart by their admission time
+        started = await self.limiter.acquire(url, rate=self.burst_rate)
+        if self.fetch_slots is not None:
+            await self.fetch_slots.acquire()
+        outcome = {"status": None, "retry_after": None}
+        sent = monotonic()
+        try:
+            yield outcome
+        finally:
+            if self.fetch_slots is not None:
+                self.fetch_slots.release()
+            await self.limiter.release(url=url, started=started, sent=sent, **outcome)
 
     async def _fetch(self, url: str) -> str | None:
-        async with self.session.get(url=url) as _data:
-            await sleep(0)
-            if _data.status not in ACCEPTABLE_CODES:
-                return None
-            extract = await _data.text()
-            return extract
+        cached = await self.response_cache.get(url) if self.response_cache is not None else None
+        async with self._slot(url) as outcome:
+            async with self.session.get(
+                    url=url,
+                    headers=cached.conditional_headers() if cached is not None else None
+            ) as _data:
+                await sleep(0)
+                outcome.update(status=_data.status, retry_after=_data.headers.get("Retry-After"))
+                if _data.status == 304 and cached is not None:
+                    return cached.body
+                if _data.status in RETRY_CODES:
+                    raise RetryableFetchError(url=url, status=_data.status)
+                if _data.status not in ACCEPTABLE_CODES:
+                    return None
+                extract = await _data.text()
+                headers = _data.headers
+        # written once the slot is released, the disk isn't the host
+        if self.response_cache is not None:
+            await self.response_cache.put(url=url, body=extract, headers=headers)
+        return extract
 
     async def _verify(self, url: str) -> str:
-        async with self.session.get(url=url, allow_redirects=False) as _data:
-            await sleep(0)
-            if _data.status == 200:
-                return "active"
-            else:
-                return "inactive"
+        async with self._slot(url) as outcome:
+            async with self.session.get(url=url, allow_redirects=False) as _data:
+                await sleep(0)
+                outcome.update(status=_data.status, retry_after=_data.headers.get("Retry-After"))
+                if _data.status == 200:
+                    return "active"
+                else:
+                    return "inactive"
     
-    async def _scrape_batch(self, batch: list[str]) -> list[Any]:
-        try:
-            async with TaskGroup() as _group:
-                _tasks = [_group.create_task(self._fetch(url)) for url in batch]
-            print(f"Data scraped for: {self!r}")
-
-            items = [item.result() for item in _tasks]
-            current_len = len(items)
-            items = [item for item in items if item is not None]
-            if current_len > len(items):
-                logger.warning("There are nones appearing in the results. Sleeping.")
-                await sleep(5)
-            return items
-        except Exception as err:
-            logger.error(err)
-            print(err)
+    def _collect(self, url: str, result: Any) -> tuple[str, str | None] | None:
+        """
+        Sorts the outcome of a single fetch. Failed urls worth another attempt go to the retry queue and
+        return None, anything else is final and returns the url along with its page, None if there's no page.
+        """
+        if isinstance(result, RETRYABLE_ERRORS):
+            if self.retries.schedule(url):
+                return None
+            logger.warning(f"{self!r} gave up on {url} after {self.retries.max_attempts} attempts: {result}")
+            return url, None
+        if isinstance(result, BaseException):
+            logger.error(result)
+            return url, None
+        self.retries.succeeded(url)
+        return url, result
+
+    async def _scrape_batch(self, batch: list[str]) -> list[tuple[str, str | None]]:
+        """
+        Returns (url, page) pairs of every url done with, page is None for the ones that failed for good.
+        """
+        results = await gather(*[self._fetch(url) for url in batch], return_exceptions=True)
+        print(f"Data scraped for: {self!r}")
+        items = [self._collect(url=url, result=result) for url, result in zip(batch, results)]
+        items = [item for item in items if item is not None]
+        if any(page is None for _, page in items) or len(items) < len(batch):
+            # backing off is left to the rate limiter, which already slowed the offending host down
+            logger.warning(f"There are nones appearing in the results. Limiter state: {self.limiter.hosts}")
+        return items
+
+    def _package(self, pipeline_name: str, items: list[tuple[str, str | None]]) -> Package:
+        return Package(
+            pipeline_name=pipeline_name,
+            step_order_id=self.pipeline_order_id,
+            data=[page for _, page in items if page is not None],
+            sources=[url for url, _ in items]
+        )
+
+    def _closing(self, package: Package) -> Package:
+        """
+        The closing package arrives stamped with the previous step. It leaves stamped with this one,
+        SyncEngine holds it back until this step's packages are extracted and the pipeline hands it to the next step.
+        """
+        package.step_order_id = self.pipeline_order_id
+        return package
+
+    async def _flush(
+            self,
+            pipeline_name: str,
+            buffer: list[tuple[str, str | None]],
+            everything: bool = False
+    ) -> list[tuple[str, str | None]]:
+        """
+        Sends buffered (url, page) pairs to outbound in packages of at most FLUSH_SIZE items.
+        Unless everything is True, the remainder smaller than FLUSH_SIZE stays in the buffer.
+        """
+        while len(buffer) >= FLUSH_SIZE or (everything and buffer):
+            _items, buffer = buffer[:FLUSH_SIZE], buffer[FLUSH_SIZE:]
+            package = self._package(pipeline_name=pipeline_name, items=_items)
+            if self.credits is not None:
+                self.credits.charge(package)
+            await self.outbound.put(package)
+        return buffer
+
+    async def scrape_streaming(self) -> None:
+        """
+        Keeps up to STREAM_WINDOW requests in flight, regardless of which package the urls came from.
+        Finished responses are buffered and flushed to outbound once FLUSH_SIZE of them are ready or
+        FLUSH_INTERVAL seconds have passed since the last flush, so a slow url never holds back the rest.
+        The closing package is forwarded only once every url has been fetched and flushed.
+        """
+        pending: deque[str] = deque()
+        in_flight: dict[Task, str] = dict()
+        buffer: list[tuple[str, str | None]] = list()
+        closing: Package | None = None
+        pipeline_name: str | None = None
+        receiving: Task | None = create_task(self.inbound.get())
+        last_flush = monotonic()
+        async with self.session:
+            while receiving is not None or pending or in_flight or self.retries:
+                pending.extend(self.retries.ready())
+                while pending and len(in_flight) < STREAM_WINDOW:
+                    url = pending.popleft()
+                    in_flight[create_task(self._fetch(url))] = url
+                waiting = set(in_flight) | {receiving} if receiving is not None else set(in_flight)
+                # wake up in time for the next flush or the next retry, whichever comes first
+                flush_due = max(0.0, FLUSH_INTERVAL - (monotonic() - last_flush)) if buffer else FLUSH_INTERVAL
+                timeout = min(flush_due, self.retries.next_due() if self.retries else flush_due)
+                if not waiting:
+                    await sleep(timeout)
+                    continue
+                done, _ = await wait(waiting, timeout=timeout, return_when=FIRST_COMPLETED)
+                for task in done:
+                    if task is receiving:
+                        _package: Package = task.result()
+                        self.inbound.task_done()
+                        logger.debug(f"Package has been received at {self.name}.")
+                        if _package.closed_inbound:
+                            closing = _package
+                            receiving = None
+                            continue
+                        pipeline_name = _package.pipeline_name
+                        pending.extend(_package.data)
+                        receiving = create_task(self.inbound.get())
+                        continue
+                    url = in_flight.pop(task)
+                    _item = self._collect(url=url, result=task.exception() or task.result())
+                    if _item is not None:
+                        buffer.append(_item)
+                if len(buffer) >= FLUSH_SIZE:
+                    buffer = await self._flush(pipeline_name=pipeline_name, buffer=buffer)
+                    last_flush = monotonic()
+                elif buffer and monotonic() - last_flush >= FLUSH_INTERVAL:
+                    buffer = await self._flush(pipeline_name=pipeline_name, buffer=buffer, everything=True)
+                    last_flush = monotonic()
+            await self._flush(pipeline_name=pipeline_name, buffer=buffer, everything=True)
+            await self.outbound.put(self._closing(closing))
+        return
 
     async def scrape_until_final(self) -> None:
+        """
+        Scrapes every package batch by batch. Failed urls ride along with the next batch once their backoff
+        expired. In between packages, the inbound queue and the next retry are awaited together,
+        so a url backing off never keeps the following packages waiting.
+        """
+        closing: Package | None = None
+        pipeline_name: str | None = None
+        receiving: Task | None = create_task(self.inbound.get())
         async with self.session:
-            while True:
-                _package: Package = await self.inbound.get()
-                logger.debug(f"Package has been received at {self.name}.")
-                if _package.closed_inbound:
-                    await self.outbound.put(_package)
-                    break
-                _urls: list[str] = _package.data
-                _batches: list[list[str]] = to_batches(urls=_urls, batch_length=BATCH_LENGTH)
-                for _batch in _batches:
-                    _data = await self._scrape_batch(batch=_batch)
-                    await self.outbound.put(
-                        Package(
-                            pipeline_name=_package.pipeline_name,
-                            step_order_id=self.pipeline_order_id,
-                            data=_data,
-                            selectors=self.selectors,
-                            closed_inbound=_package.closed_inbound
-                        )
-                    )
+            while receiving is not None or self.retries:
+                if receiving is not None:
+                    done, _ = await wait({receiving}, timeout=self.retries.next_due() if self.retries else None)
+                else:
+                    await sleep(self.retries.next_due())
+                    done = set()
+                if receiving in done:
+                    _package: Package = receiving.result()
+                    self.inbound.task_done()
+                    logger.debug(f"Package has been received at {self.name}.")
+                    if _package.closed_inbound:
+                        closing = _package
+                        receiving = None
+                        continue
+                    pipeline_name = _package.pipeline_name
+                    _urls: list[str] = _package.data
+                    _batches: list[list[str]] = to_batches(urls=_urls, batch_length=BATCH_LENGTH)
+                    for _batch in _batches:
+                        # failed urls whose backoff already expired ride along with the next batch
+                        _items = await self._scrape_batch(batch=_batch + self.retries.ready())
+                        # charged like streamed packages, so credits and FairQueue hold batch mode back as well
+                        await self._flush(pipeline_name=pipeline_name, buffer=_items, everything=True)
+                    receiving = create_task(self.inbound.get())
+                _retries = self.retries.ready()
+                if _retries:
+                    _items = await self._scrape_batch(batch=_retries)
+                    await self._flush(pipeline_name=pipeline_name, buffer=_items, everything=True)
+            await self.outbound.put(self._closing(closing))
         return
 
     async def run(self):
         logger.debug(f"Run has been called for {self!r}")
         assert self.inbound is not None
         assert self.outbound is not None
-        await self.scrape_until_final()
+        if self.session is None:
+            self.session = self.get_aiohttp_session(headers=self.headers, trust_env=True, timeout=None)
+        if self.streaming:
+            await self.scrape_streaming()
+        else:
+            await self.scrape_until_final()
+        logger.info(f"Retries for {self!r}: {self.retries.report()}")
         self.finished.set()
         return None
 
@@ -0,0 +1,53 @@
+from pathlib import Path
+from time import monotonic
+from uuid import uuid4
+
+from app.class_models.row_batch import RowBatch
+
+# how LOAD DATA reads a spool: FIELDS TERMINATED BY '\t' ESCAPED BY '\\' LINES TERMINATED BY '\n', \N being NULL
+ESCAPES = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r", "\0": "\\0"})
+NULL = "\\N"
+
+
+def tsv_field(value) -> str:
+    if value is None:
+        return NULL
+    if isinstance(value, bytes):
+        value = value.decode(errors="replace")
+    elif not isinstance(value, str):
+        value = str(value)
+    return value.translate(ESCAPES)
+
+
+class TsvSpool:
+
+    def __init__(self, directory: Path, table_name: str, columns: tuple[str, ...]):
+        """
+        :param columns: every batch written to the spool has to have these, in this order.
+        Rows of a single table staged in a tab separated file, to be bulk loaded with LOAD DATA LOCAL INFILE.
+        Written as the packages arrive, so only the file grows while it waits for its thresholds.
+        """
+        self.table_name = table_name
+        self.columns = columns
+        self.path = directory / f"{table_name}.{uuid4().hex}.tsv"
+        self.file = open(self.path, "w", encoding="utf-8", newline="")
+        self.rows = 0
+        self.bytes = 0
+        self.created = monotonic()
+
+    def __repr__(self):
+        return f"TsvSpool({self.table_name}, {self.rows} rows, {self.bytes} bytes)"
+
+    @property
+    def age(self) -> float:
+        return monotonic() - self.created
+
+    def write(self, batch: RowBatch) -> None:
+        lines = "".join("\t".join(map(tsv_field, row)) + "\n" for row in batch.rows())
+        self.file.write(lines)
+        self.rows += len(batch)
+        self.bytes += len(lines)
+
+    def close(self) -> Path:
+        self.file.close()
+        return self.path
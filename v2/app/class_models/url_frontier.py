@@ -0,0 +1,80 @@
+from hashlib import blake2b
+from math import ceil, log
+
+from w3lib.url import canonicalize_url
+
+# amount of urls a pipeline's Bloom filter is sized for, the false positive rate degrades past it
+FRONTIER_CAPACITY = 2_000_000
+# chance of a never seen url being taken for a duplicate, while under capacity
+FRONTIER_ERROR_RATE = 0.001
+
+
+class BloomFilter:
+
+    def __init__(self, capacity: int = FRONTIER_CAPACITY, error_rate: float = FRONTIER_ERROR_RATE):
+        """
+        Fixed size set membership with false positives but no false negatives.
+        Memory stays at roughly 1.8 bytes per expected item for a 0.1% error rate, no matter how many are added.
+        """
+        self.size = ceil(-capacity * log(error_rate) / log(2) ** 2)
+        self.hashes = max(1, round(self.size / capacity * log(2)))
+        self.bits = bytearray(ceil(self.size / 8))
+
+    def _positions(self, key: bytes):
+        digest = blake2b(key, digest_size=16).digest()
+        # double hashing, k positions out of two independent 64-bit hashes
+        first, second = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return ((first + i * second) % self.size for i in range(self.hashes))
+
+    def add(self, key: bytes) -> bool:
+        """
+        Adds the key, returns False if it was (probably) already there.
+        """
+        added = False
+        for position in self._positions(key):
+            byte, bit = divmod(position, 8)
+            if not self.bits[byte] & (1 << bit):
+                self.bits[byte] |= 1 << bit
+                added = True
+        return added
+
+
+class ExactSet:
+
+    def __init__(self):
+        """
+        Same interface as BloomFilter without false positives, memory grows with every url.
+        """
+        self.keys: set[bytes] = set()
+
+    def add(self, key: bytes) -> bool:
+        if key in self.keys:
+            return False
+        self.keys.add(key)
+        return True
+
+
+class UrlFrontier:
+
+    def __init__(self, exact: bool = False, capacity: int = FRONTIER_CAPACITY, error_rate: float = FRONTIER_ERROR_RATE):
+        """
+        :param exact: keep an exact set of seen urls instead of a memory bounded Bloom filter.
+        Sits between the steps of a pipeline and lets through only urls a step hasn't been sent before.
+        Urls are compared in their canonical form (sorted query, no fragment...), but forwarded as they were found.
+        """
+        self.seen = ExactSet() if exact else BloomFilter(capacity=capacity, error_rate=error_rate)
+        self.dropped = 0
+
+    @staticmethod
+    def key(url: str, step_order_id: int) -> bytes:
+        # the same url may legitimately be sent to different steps, so the step is part of the key
+        return f"{step_order_id}|{canonicalize_url(url)}".encode()
+
+    def filter(self, urls: list[str], step_order_id: int) -> list[str]:
+        """
+        :param step_order_id: the step the urls are about to be sent to.
+        Returns the urls not seen before, in order and without duplicates within the list itself.
+        """
+        unseen = [url for url in urls if self.seen.add(self.key(url=url, step_order_id=step_order_id))]
+        self.dropped += len(urls) - len(unseen)
+        return unseen
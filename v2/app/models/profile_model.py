@@ -7,7 +7,7 @@ from .selector_model import (
     func,
     VARCHAR,
 )
-from sqlalchemy import JSON
+from sqlalchemy import JSON, Integer
 
 
 class ProfileModel(Base):
@@ -16,6 +16,7 @@ class ProfileModel(Base):
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     name: Mapped[str] = mapped_column(VARCHAR(255), nullable=False, index=True, unique=True)
     burst_rate: Mapped[int] = mapped_column(VARCHAR(255), nullable=False, default=2)
+    priority: Mapped[int] = mapped_column(Integer, nullable=False, default=1, server_default="1")
     headers: Mapped[dict] = mapped_column(JSON, nullable=False)
     cookies: Mapped[dict] = mapped_column(JSON, nullable=True)
     last_updated: Mapped[datetime] = mapped_column(AwareDateTime, default=func.now(), nullable=False)
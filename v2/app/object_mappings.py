@@ -13,6 +13,9 @@ from .models.auth_model import UserModel
 from .class_models.selector import *
 from .class_models.step import Scraper
 from .class_models.profile import Profile
+from .class_models.response_cache import ResponseCache
+
+from crow_config import RESPONSE_CACHE_PATH
 
 from typing import Type
 
@@ -48,6 +51,7 @@ def resolve_selector(selector: SelectorSchema) -> Type[CrowSelector]:
         case "json": return JsonSelector
         case "static": return StaticSelector
         case "css": return CssSelector
+        case "row": return RowSelector
         case _: raise TypeError
 
 
@@ -57,7 +61,8 @@ def custom_model_to_schema(custom_model: Profile | Scraper | CrowSelector) -> Ba
             name=custom_model.name,
             burst_rate=custom_model.burst_rate,
             headers=custom_model.headers,
-            cookies=custom_model.cookies
+            cookies=custom_model.cookies,
+            priority=custom_model.priority
         )
     elif isinstance(custom_model, Scraper):
         return ScraperModel(
@@ -116,7 +121,9 @@ def scraper_schema_to_scraper_model(
         headers=(lambda x: x if x is not None else headers)(schema.headers),
         pipeline_order_id=pipeline_order_id,
         initial_url=schema.initial_url,
-        burst_rate=(lambda x: x if x is not None else burst_rate)(schema.burst_rate)
+        burst_rate=(lambda x: x if x is not None else burst_rate)(schema.burst_rate),
+        streaming=schema.streaming,
+        response_cache=ResponseCache(path=RESPONSE_CACHE_PATH) if schema.conditional_cache else None
     )
 
 
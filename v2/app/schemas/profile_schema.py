@@ -5,6 +5,7 @@ class ProfileSchema(BaseModel):
 
     name: str = Field(max_length=100, nullable=False)
     burst_rate: int = Field(default=2)
+    priority: int = Field(default=1, ge=1)
     headers: dict | None = Field(default=None)
     cookies: dict | None = Field(default=None)
 
@@ -9,3 +9,5 @@ class ScraperModel(BaseModel):
     headers: dict | None = Field(default=None)
     burst_rate: int | None = Field(default=None)
     initial_url: str | None = Field(default=None)
+    streaming: bool = Field(default=True)
+    conditional_cache: bool = Field(default=False)
@@ -1,5 +1,6 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, field_validator
 from app.utils.case_insensitive_enums import SelectorType, SelectorMethod
+from app.class_models.post_processor import PostProcessor
 
 
 class SelectorSchema(BaseModel):
@@ -12,5 +13,13 @@ class SelectorSchema(BaseModel):
     default_return: str | None = None
     post_processor: str | None = None
 
+    @field_validator("post_processor")
+    @classmethod
+    def check_post_processor(cls, raw: str | None) -> str | None:
+        # refuses expressions the selector wouldn't run, instead of finding out during extraction
+        if raw is not None:
+            PostProcessor(raw)
+        return raw
+
     def __repr__(self):
         return self.name
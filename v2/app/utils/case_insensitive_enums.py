@@ -17,6 +17,7 @@ class SelectorType(CaseInsensitiveEnum):
     Json = "json"
     Css = "css"
     Static = "static"
+    Row = "row"
 
 
 class SelectorMethod(CaseInsensitiveEnum):
@@ -0,0 +1,104 @@
+"""
+Per-pattern searches against RegexScan, for first-match regex selectors of a single step.
+
+Run from v2:
+    python -m benchmarks.regex_scan
+
+Every scenario asserts that RegexScan returns the very matches the per-pattern searches do.
+Numbers of a run on Python 3.11.7, Linux x86_64, milliseconds per page:
+
+    scenario                                          separate   merged   speedup
+    1 MB page, 24 meta tags + 2 script variables          1.60     0.89      1.8x
+    800 KB page, 20 meta tags spread over it              7.60     0.83      9.1x
+    800 KB page, 20 patterns without a shared prefix     68.64    70.38      1.0x
+    the same, merged regardless of their prefix          86.84   175.32      0.5x
+
+plan_regex_scans leaves patterns without a shared prefix to their own searches, hence the third row.
+The last one is why, the whole alternation is tried at every position of the page.
+"""
+import random
+import re
+from timeit import timeit
+
+from app.class_models.regex_scan import RegexScan, plan_regex_scans
+
+WORDS = ["lorem", "ipsum", "dolor", "sit", "amet", "data", "value", "class", "div", "span"]
+# searches of every page, the best of REPEATS rounds is reported
+NUMBER = 20
+REPEATS = 3
+
+
+def filler(size: int) -> list[str]:
+    chunks = list()
+    while sum(map(len, chunks)) < size:
+        chunks.append(f'<div class="{random.choice(WORDS)}">{" ".join(random.choices(WORDS, k=3))}</div>')
+    return chunks
+
+
+def product_page() -> tuple[str, list[re.Pattern]]:
+    # meta tags in the head, two variables of a script at the bottom, both missing from the page
+    fields = [f"product:field{index}" for index in range(24)]
+    head = [f'<meta property="{field}" content="{random.random()}">' for field in fields]
+    page = "\n".join(head + filler(1024 * 1024) + ['<script>var price = 19.99;</script>'])
+    patterns = [re.compile(fr'<meta property="{field}" content="(.*?)">') for field in fields]
+    patterns += [re.compile(r'<script>var stock = (\d+);'), re.compile(r'<script>var rating = ([\d.]+);')]
+    return page, patterns
+
+
+def spread_page() -> tuple[str, list[re.Pattern]]:
+    fields = [f"field{index}" for index in range(20)]
+    chunks = filler(800 * 1024)
+    for field in fields:
+        chunks.insert(random.randrange(len(chunks)), f'<meta name="{field}" content="{random.random()}">')
+    page = "\n".join(chunks)
+    return page, [re.compile(fr'<meta name="{field}" content="(.*?)">') for field in fields]
+
+
+def unshared_page() -> tuple[str, list[re.Pattern]]:
+    page, patterns = spread_page()
+    # the same tags, matched by either attribute, which leaves no literal prefix for re to scan for
+    fields = [f"field{index}" for index in range(len(patterns))]
+    return page, [re.compile(fr'(?:name|property)="{field}" content="(.*?)">') for field in fields]
+
+
+def measure(page: str, patterns: list[re.Pattern], planned: bool = True) -> tuple[float, float]:
+    """
+    :param planned: patterns are grouped by plan_regex_scans, the way SelectorList does, otherwise all of them
+    are scanned together.
+    """
+    groups, single = plan_regex_scans(patterns) if planned else ([list(range(len(patterns)))], list())
+    scans = [(RegexScan([patterns[index] for index in indices]), indices) for indices in groups]
+
+    def separate() -> list[re.Match | None]:
+        return [pattern.search(page) for pattern in patterns]
+
+    def merged() -> list[re.Match | None]:
+        found: list[re.Match | None] = [None] * len(patterns)
+        for scan, indices in scans:
+            for index, match in zip(indices, scan.search(page)):
+                found[index] = match
+        for index in single:
+            found[index] = patterns[index].search(page)
+        return found
+
+    expected = [match and (match.span(), match.groups()) for match in separate()]
+    assert [match and (match.span(), match.groups()) for match in merged()] == expected
+    return tuple(min(timeit(run, number=NUMBER) for _ in range(REPEATS)) / NUMBER * 1000 for run in (separate, merged))
+
+
+def main() -> None:
+    random.seed(1)
+    scenarios = {
+        "1 MB page, 24 meta tags + 2 script variables": (product_page, True),
+        "800 KB page, 20 meta tags spread over it": (spread_page, True),
+        "800 KB page, 20 patterns without a shared prefix": (unshared_page, True),
+        "the same, merged regardless of their prefix": (unshared_page, False),
+    }
+    print(f"{'scenario':<48} {'separate':>9} {'merged':>8} {'speedup':>9}")
+    for name, (build, planned) in scenarios.items():
+        separate, merged = measure(*build(), planned=planned)
+        print(f"{name:<48} {separate:>9.2f} {merged:>8.2f} {separate / merged:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -9,6 +9,24 @@ SYS = platform.system()
 SYS_DEL = "/" if SYS.lower() in ["linux", "darwin"] else "\\"
 
 APP_PATH = Path(os.path.dirname(os.path.abspath(__file__))) / "app"
+# where Scrapers with conditional_cache enabled keep the responses they revalidate on recrawl
+RESPONSE_CACHE_PATH = APP_PATH.parent / "cache" / "responses"
+# one SQLite file per profile, lets a pipeline resume where it stopped if the server went down mid crawl
+CHECKPOINT_PATH = APP_PATH.parent / "cache" / "checkpoints"
+# extraction results of identical pages, kept in memory by every extraction worker. 0 turns the cache off.
+EXTRACTION_CACHE_SIZE = 10_000
+# on-disk tier of the extraction cache, shared by the workers and kept across runs. None keeps it in memory only,
+# APP_PATH.parent / "cache" / "extractions" turns it on.
+EXTRACTION_CACHE_PATH = None
+# rows sent to the database per INSERT statement, a batch failing as a whole is bisected down to the offending rows
+INSERT_CHUNK_SIZE = 1000
+# stages the rows of finished steps in TSV files and bulk loads them with LOAD DATA LOCAL INFILE instead of INSERTs,
+# for pipelines producing millions of rows. The server has to allow it as well, local_infile=ON.
+BULK_LOAD = False
+BULK_LOAD_SPOOL_PATH = APP_PATH.parent / "cache" / "spool"
+# a spool is loaded once it holds this many bytes, or once it's been open for this many seconds
+BULK_LOAD_BYTES = 64 * 1024 * 1024
+BULK_LOAD_SECONDS = 30.0
 
 CORE_DATABASE_PARAMS = {
     "dialect": "mysql",
@@ -6,12 +6,14 @@ from sqlalchemy.ext.asyncio import (create_async_engine,
                                     AsyncConnection,
                                     AsyncEngine
                                     )
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.exc import SQLAlchemyError, DBAPIError
 from sqlalchemy import URL, exc, text, inspect, select, update, delete, insert
+from sqlalchemy.schema import CreateColumn
 from typing import AsyncIterator, Any
+from pathlib import Path
 from collections import OrderedDict
 
-from crow_config import CORE_DATABASE_PARAMS
+from crow_config import CORE_DATABASE_PARAMS, INSERT_CHUNK_SIZE, BULK_LOAD
 from contextlib import asynccontextmanager
 from abc import ABC, ABCMeta, abstractmethod
 
@@ -22,6 +24,41 @@ from app.schemas.error_schema import ErrorSchema
 from app.utils.decompile_url_name import get_url_name
 
 from app.object_mappings import Base, BaseModel, resolve_model, orm_to_schema
+from app.class_models.row_batch import RowBatch, is_records
+
+
+def quote_identifier(name: str) -> str:
+    # % is doubled since statements run in the driver's paramstyle
+    return "`" + name.replace("`", "``").replace("%", "%%") + "`"
+
+
+def add_missing_columns(connection) -> None:
+    """
+    create_all leaves tables that already exist as they are, so columns added to a core model since
+    are added here. They need to be nullable or to have a server_default, which existing rows are given.
+    """
+    inspector = inspect(connection)
+    preparer = connection.dialect.identifier_preparer
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            definition = CreateColumn(column).compile(dialect=connection.dialect)
+            connection.exec_driver_sql(f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {definition}")
+            logger.info(f"Added column {column.name} to {table.name}.")
+
+
+def to_parameter(value):
+    """
+    Values the driver can bind as they are, anything else (lists of the all method, objects returned by
+    post processors) is stored as its string, the way it always was.
+    """
+    if value is None or isinstance(value, (str, int, float, bytes)):
+        return value
+    return str(value)
 
 
 def construct_engine_url(config: dict) -> URL:
@@ -167,6 +204,7 @@ class MySQLDatabase(Database):
             connection = self.get_connection()
             async with connection as conn:
                 await conn.run_sync(Base.metadata.create_all)
+                await conn.run_sync(add_missing_columns)
             return
         except Exception as err:
             logger.error(err)
@@ -219,6 +257,9 @@ class MySQLDatabase(Database):
         ]
 
         for selector in selectors:
+            # a row container selects the records themselves, it doesn't hold a value of its own
+            if selector._name == "row":
+                continue
             columns.append(f"`{selector.name}` VARCHAR(255) {'NOT NULL' if selector.required else ''}")
         # line below serves to maintain order in columns, can very well be placed inside columns' initiation.
         columns.append("scraped_date DATETIME DEFAULT CURRENT_TIMESTAMP")
@@ -229,31 +270,95 @@ class MySQLDatabase(Database):
             query = f"CREATE TABLE {_name} ({', '.join(columns)})"
         return query
 
-    async def insert_scraped_data(self, data: list[dict], table_name: str):
+    @staticmethod
+    def insert_statement(table_name: str, columns: tuple[str, ...]) -> str:
+        """
+        Parameterized INSERT in the driver's own paramstyle, the driver sends a chunk of rows as one
+        multi row statement and escapes every value itself.
+        """
+        names = ", ".join(quote_identifier(column) for column in columns)
+        placeholders = ", ".join("%s" for _ in columns)
+        return f"INSERT INTO {get_url_name(table_name)} ({names}) VALUES ({placeholders})"
+
+    async def _insert_rows(self, session: AsyncSession, statement: str, rows: list, first: int) -> list[tuple[int, str]]:
+        """
+        :param first: index of rows[0] within the whole batch, used to report failed rows.
+        Inserts rows with a single statement inside a savepoint, so a failure leaves the rest of the batch intact.
+        If the statement fails, both halves are retried on their own, down to the rows at fault.
+        A bad row costs a handful of statements instead of the whole batch going row at a time.
+        :return: index within the batch and error of every row that couldn't be inserted.
+        """
+        try:
+            async with session.begin_nested():
+                connection = await session.connection()
+                await connection.exec_driver_sql(statement, rows)
+            return list()
+        except DBAPIError as err:
+            if err.connection_invalidated:
+                raise
+            if len(rows) == 1:
+                return [(first, str(err.orig))]
+        middle = len(rows) // 2
+        failed = await self._insert_rows(session=session, statement=statement, rows=rows[:middle], first=first)
+        failed.extend(
+            await self._insert_rows(session=session, statement=statement, rows=rows[middle:], first=first + middle)
+        )
+        return failed
+
+    async def insert_scraped_data(
+            self,
+            data: RowBatch | list[dict],
+            table_name: str,
+            chunk_size: int = INSERT_CHUNK_SIZE
+    ) -> list[tuple[int, str]]:
 
         """
         :param data: intended to be a batch of scraped data
         ( usually 200. Find in app.class_models.step_model BATCH_LENGTH var)
         :param table_name: already created table in core database.
-        Bulk inserts data into a dynamic table in SQL.
+        :param chunk_size: rows per INSERT statement.
+        Bulk inserts data into a dynamic table in SQL, chunk_size rows per round trip, committed once.
+        :return: index within data and error of every row that wasn't inserted, the rest of the batch is.
         """
+        if not isinstance(data, RowBatch):
+            if not is_records(data):
+                if data:
+                    logger.error(f"Expected records to insert into {table_name}, got {type(data).__name__}")
+                return list()
+            data = RowBatch.from_records(data)
+        # you can add static columns to the statement and their values to the rows if need be.
+        statement = self.insert_statement(table_name=table_name, columns=data.columns)
+        rows = [tuple(map(to_parameter, row)) for row in data.rows()]
+        failed = list()
         session = self.get_session()
         async with session as session:
-            for item in data:
-                try:
-                    # you can add static key-value pairs to item if need be.
-                    args_str = '(' + ','.join(f"'{v}'" for k, v in item.items()) + ')'
-                    keys = '(' + ', '.join(f"`{k}`" for k, v in item.items()) + ')'
-                    await session.execute(
-                        text(
-                            f"INSERT INTO {get_url_name(table_name)} {keys} VALUES " + args_str
-                        )
+            for start in range(0, len(rows), chunk_size):
+                failed.extend(
+                    await self._insert_rows(
+                        session=session, statement=statement, rows=rows[start:start + chunk_size], first=start
                     )
-                except Exception as err:
-                    print(err)
-                    logger.error(err)
+                )
             await session.commit()
-        return
+        for index, error in failed:
+            logger.error(f"Row {index} of {len(rows)} was not inserted into {table_name}: {error}")
+        return failed
+
+    async def load_data_file(self, table_name: str, columns: tuple[str, ...], path: Path) -> int:
+        """
+        :param path: TsvSpool file, fields and lines are expected the way TsvSpool writes them.
+        Bulk loads a spool into a dynamic table with LOAD DATA LOCAL INFILE, a single statement however many rows.
+        With LOCAL, rows clashing with a unique key are skipped with a warning instead of failing the load.
+        :return: rows loaded.
+        """
+        names = ", ".join(quote_identifier(column) for column in columns)
+        statement = (
+            f"LOAD DATA LOCAL INFILE %s INTO TABLE {get_url_name(table_name)} CHARACTER SET utf8mb4 "
+            "FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' "
+            f"({names})"
+        )
+        async with self.get_connection() as connection:
+            result = await connection.exec_driver_sql(statement, (str(path), ))
+        return result.rowcount
 
     async def insert_item(self, schema: BaseModel) -> Any:
         """
@@ -382,4 +487,5 @@ class MySQLDatabase(Database):
                                     )))
 
 
-CORE_DATABASE = MySQLDatabase()
+# LOAD DATA LOCAL is refused unless the client enables it as well
+CORE_DATABASE = MySQLDatabase(engine_config={"connect_args": {"local_infile": True}} if BULK_LOAD else {})
@@ -27,6 +27,7 @@ from crow_database import CORE_DATABASE
 
 from engines.async_engine import AsyncEngine, mp, Task
 from engines.sync_engine import SyncEngine
+from engines.message_pipe import message_pipe
 
 from fastapi.encoders import jsonable_encoder
 
@@ -42,11 +43,13 @@ async def lifespan(app: FastAPI):
     global ASYNC_ENGINE_RUN_TASK
     await CORE_DATABASE.create_core_tables()
     try:
-        SYNC_ENGINE = SyncEngine(inbound=SYNC_INBOUND, outbound=SYNC_OUTBOUND)
+        SYNC_ENGINE = SyncEngine(inbound=SYNC_INBOUND, outbound=SYNC_OUTBOUND_SENDER)
         ASYNC_ENGINE = AsyncEngine(inbound=SYNC_OUTBOUND, outbound=SYNC_INBOUND)
         SYNC_PROCESS = mp.Process(target=SYNC_ENGINE.initiate)
 
         SYNC_PROCESS.start()
+        # the process has its own copy now, closing this one lets the pipe tell when SyncEngine goes away
+        SYNC_OUTBOUND_SENDER.close()
         ASYNC_ENGINE_RUN_TASK = asyncio.create_task(ASYNC_ENGINE.run())
     except KeyboardInterrupt:
         ASYNC_ENGINE_RUN_TASK.cancel(msg="Keyboard Interrupt.")
@@ -59,10 +62,12 @@ async def lifespan(app: FastAPI):
                                 err_message=err.args[0]
                             ))
     yield
-    exit(-1)
-    queue_handler.listener.stop()
+    # pipelines still running are left unfinished in their checkpoints and resume on the next start
+    ASYNC_ENGINE_RUN_TASK.cancel()
+    await ASYNC_ENGINE.close()
+    SYNC_PROCESS.terminate()
     SYNC_PROCESS.join()
-    #ASYNC_ENGINE_RUN_TASK.cancel()
+    queue_handler.listener.stop()
     await CORE_DATABASE.close()
 
 app = FastAPI(debug=True, lifespan=lifespan)
@@ -78,7 +83,7 @@ app.add_middleware(
 
 
 SYNC_INBOUND = mp.Queue()
-SYNC_OUTBOUND = mp.Queue()
+SYNC_OUTBOUND, SYNC_OUTBOUND_SENDER = message_pipe()
 SYNC_ENGINE: SyncEngine
 ASYNC_ENGINE: AsyncEngine
 SYNC_PROCESS: mp.Process
@@ -104,6 +109,11 @@ async def initiate_pipeline():
     return True
 
 
+@pipeline.get("/queue_depths")
+async def queue_depths(user: VerifiedUser) -> dict:
+    return ASYNC_ENGINE.depths()
+
+
 @pipeline.post("/create_profile")
 async def create_profile(
         profile: ProfileSchema,
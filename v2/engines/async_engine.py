@@ -1,25 +1,47 @@
 import asyncio
-import concurrent.futures
+import re
 import multiprocessing as mp
-import time
-from asyncio import Task, BaseEventLoop, get_running_loop
-from app.class_models.pipeline import ScrapingPipeline, AsyncQueue, sleep, create_task
+from asyncio import Task, BaseEventLoop, Event as AsyncEvent, get_running_loop
+from app.class_models.pipeline import ScrapingPipeline, AsyncQueue, create_task
 from app.class_models.package import Package
+from app.class_models.connection_registry import ConnectionRegistry
+from app.class_models.rate_limiter import AdaptiveRateLimiter
+from app.class_models.checkpoint import PipelineCheckpoint
+from app.class_models.flow_control import CreditPool, Credit
 
 from app.logger.crow_logger import logger
 
 from crow_database import CORE_DATABASE
+from crow_config import CHECKPOINT_PATH, BULK_LOAD
 
-# the number of concurrent pipelines being handled. This is in order to control the stress on the machine.
-# I run a very old laptop and its not fun having more than 5 concurrent pipelines.
-MAX_WORKERS = 5
+from engines.scheduler import PipelineScheduler
+from engines.shared_memory_transport import SharedMemoryRing, SharedPages
+from engines.message_pipe import PipeReceiver
+from engines.bulk_load import BulkLoadSink
+from engines.write_behind import WriteBehindBuffer
+
+# bytes of fetched pages allowed in flight between the Scrapers and the end of extraction, see CreditPool
+MAX_BYTES_IN_FLIGHT = 256 * 1024 * 1024
+# extracted packages waiting for the database. Beyond it SyncEngine's results stop being received, PipeReceiver
+# stops reading once MAX_PENDING of them wait, and SyncEngine blocks on the full pipe.
+DATABASE_QUEUE_SIZE = 100
+# seconds between two looks for spools that have waited long enough to be loaded, with BULK_LOAD on
+SPOOL_CHECK_INTERVAL = 1.0
+
+
+def queue_size(queue: mp.Queue) -> int | None:
+    try:
+        return queue.qsize()
+    except NotImplementedError:
+        # macOS doesn't implement it
+        return None
 
 
 class AsyncEngine:
 
     def __init__(
             self,
-            inbound: mp.Queue,
+            inbound: PipeReceiver,
             outbound: mp.Queue
     ) -> None:
         """
@@ -29,35 +51,67 @@ class AsyncEngine:
         self.inbound = inbound
         self.outbound = outbound
         self.pipeline_backlog = AsyncQueue()
-        self.pipeline_outbound = AsyncQueue()
+        # admits pipelines by priority and splits fetch and extraction capacity between them
+        self.scheduler = PipelineScheduler()
+        self.pipeline_outbound = self.scheduler.outbound
         self.pipelines: dict[str, ScrapingPipeline] = dict()
+        # last step of every pipeline whose results are still coming from SyncEngine, it routes them
+        # even once the Scrapers are done, along with the event set once the last step's closing package is back
+        self.routes: dict[str, int] = dict()
+        self.drained: dict[str, AsyncEvent] = dict()
         self.tasks: list[Task] = list()
         self.loop: BaseEventLoop | None = None
-        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=10)
-        self.database = AsyncQueue()
+        self.database = AsyncQueue(maxsize=DATABASE_QUEUE_SIZE)
+        # with BULK_LOAD on, rows are spooled to disk and bulk loaded instead of inserted package by package
+        self.sink = BulkLoadSink(database=CORE_DATABASE) if BULK_LOAD else None
+        # otherwise rows are coalesced per table and inserted by several writers at once
+        self.write_behind = WriteBehindBuffer(write=CORE_DATABASE.insert_scraped_data, on_written=self.exported)
+        # pauses fetching while extraction is behind, SyncEngine returns credits for every extracted package
+        self.credits = CreditPool(capacity=MAX_BYTES_IN_FLIGHT)
+        # a single connection pool for all pipelines, so steps targeting the same host reuse connections
+        self.connections = ConnectionRegistry()
+        # and a single rate limiter per host, so steps and pipelines hitting the same host share its rate
+        self.limiter = AdaptiveRateLimiter()
+        # outlive their pipelines until the database has received everything the pipeline scraped
+        self.checkpoints: dict[str, PipelineCheckpoint] = dict()
+        # pages travel to SyncEngine through shared memory, only their offsets get pickled
+        try:
+            self.transport: SharedMemoryRing | None = SharedMemoryRing()
+        except OSError as err:
+            logger.error(f"Shared memory unavailable, pages will be pickled: {err}")
+            self.transport = None
 
     async def track_new_pipelines(self):
         """
-        Awaits new Pipeline from the backlog, creates a reference to it in self.pipelines as well as self.tasks
-        and forwards it to another coroutine for handling.
+        Awaits new Pipeline from the backlog and submits it to the scheduler, which orders it by priority.
         Runs indefinitely, should implement kill/pause asyncio.Event
         """
         while True:
-            if len(self.pipelines) < MAX_WORKERS:
-                pipeline: ScrapingPipeline = await self.pipeline_backlog.get()
-                self.pipelines[pipeline.profile.name] = pipeline
-                task = create_task(self.handle_pipeline(pipeline=pipeline))
-                self.tasks.append(task)
-            else:
-                pass
-            await sleep(5)
+            pipeline: ScrapingPipeline = await self.pipeline_backlog.get()
+            await self.scheduler.submit(pipeline)
+
+    async def admit_pipelines(self):
+        """
+        Awaits the next Pipeline the scheduler admits, creates a reference to it in self.pipelines as well as
+        self.tasks and forwards it to another coroutine for handling. Admission happens the moment a slot frees up.
+        Runs indefinitely, should implement kill/pause asyncio.Event
+        """
+        while True:
+            pipeline = await self.scheduler.admit()
+            self.pipelines[pipeline.profile.name] = pipeline
+            self.routes[pipeline.profile.name] = len(pipeline.scrapers) - 1
+            self.drained[pipeline.profile.name] = AsyncEvent()
+            task = create_task(self.handle_pipeline(pipeline=pipeline))
+            self.tasks.append(task)
 
     async def handle_pipeline(self, pipeline: ScrapingPipeline):
         """
         Takes care of a given pipeline. Creates relevant database so that scraped data have somewhere to go.
-        Initiates the pipeline and waits for it to clean up.
+        Initiates the pipeline and waits for it to clean up, then for SyncEngine to send back the last step's
+        closing package, the last thing it sends for the pipeline.
         """
         logger.info(f"New pipeline {pipeline!r} is being handled")
+        pipeline.checkpoint = self.get_checkpoint(name=pipeline.profile.name)
         try:
             await CORE_DATABASE.create_dynamic_table(table_name=pipeline.profile.name,
                                                      selectors=pipeline.scrapers[-1].selectors)
@@ -65,39 +119,78 @@ class AsyncEngine:
             logger.error(err)
         else:
             logger.info("Success")
-        await pipeline.initiate(outbound=self.pipeline_outbound, database=self.database)
-        await pipeline.clean_up_scrapers()
-        self.pipelines.pop(pipeline.profile.name)
+        # SyncEngine learns the selectors of every step once, packages only refer to them
+        for plan in pipeline.extraction_plans():
+            self.outbound.put(plan)
+        try:
+            await pipeline.initiate(
+                outbound=self.pipeline_outbound,
+                database=self.database,
+                connections=self.connections,
+                limiter=self.limiter,
+                fetch_slots=self.scheduler.fetch.client(pipeline.profile.name),
+                credits=self.credits.client(pipeline.profile.name)
+            )
+            await pipeline.clean_up_scrapers()
+            await self.drained[pipeline.profile.name].wait()
+        finally:
+            self.pipelines.pop(pipeline.profile.name)
+            self.routes.pop(pipeline.profile.name, None)
+            self.drained.pop(pipeline.profile.name, None)
+            await self.scheduler.release(pipeline)
+        self.finish_checkpoint(name=pipeline.profile.name)
         logger.info(f"Pipeline {pipeline!r} has been cleaned up and removed from tasks.")
         return
 
+    def get_checkpoint(self, name: str) -> PipelineCheckpoint:
+        if name not in self.checkpoints:
+            file_name = re.sub(r"[^\w.-]", "_", name)
+            self.checkpoints[name] = PipelineCheckpoint(CHECKPOINT_PATH / f"{file_name}.sqlite")
+        return self.checkpoints[name]
+
+    def finish_checkpoint(self, name: str) -> None:
+        """
+        Removes the checkpoint of a pipeline that is no longer running and has nothing left unfinished.
+        Otherwise, it stays on disk, either for the remaining database exports or for a future resume.
+        """
+        checkpoint = self.checkpoints.get(name)
+        if checkpoint is None or name in self.pipelines or not checkpoint.is_complete():
+            return
+        self.checkpoints.pop(name).remove()
+        logger.info(f"Pipeline {name} finished, checkpoint removed.")
+
     async def forward_from_sync_engine(self):
         """
-        Indefinitely awaits package from SyncEngine. The package contains information that helps forward
+        Indefinitely awaits packages from SyncEngine. The package contains information that helps forward
         the package to the adequate Pipeline and consequently Scraper.
+        Every wakeup handles all the messages that arrived in the meantime.
         Should implement kill/pause asyncio.Event
         """
         while True:
-            start = time.time()
-            print(f"______________________________________________________")
-            # runs in executor since self.inbound.get is a synchronous function
-            data = await self.loop.run_in_executor(self.executor, self.inbound.get)
-            print(f"Package {data.pipeline_name} has been retrieved from SyncEngine.")
-            # assert that everything that comes out of that queue is a package.
-            assert isinstance(data, Package)
-            if data.step_order_id == len(self.pipelines[data.pipeline_name].scrapers) - 1:
-                # if the Step / Scraper which sent the data is the last one in the line,
-                # send the package to the database output queue
-                await self.database.put(data)
-                print(f"Package placed in {self.pipelines[data.pipeline_name]}")
-                print(f"______________________________________________________")
-                print(f"TIME: {time.time() - start}")
-                continue
-            # forward the package to the pipeline for internal handling.
-            await self.pipelines[data.pipeline_name].general_inbound.put(data)
-            print(f"Package placed in {self.pipelines[data.pipeline_name]}")
-            print(f"______________________________________________________")
-            print(f"TIME: {time.time()-start}")
+            for data in await self.inbound.receive():
+                if isinstance(data, SharedPages):
+                    # SyncEngine is done with these pages, their place in the ring can be reused
+                    self.transport.free(data)
+                    continue
+                if isinstance(data, Credit):
+                    self.credits.release(data)
+                    continue
+                # assert that everything else that comes out of the pipe is a package.
+                assert isinstance(data, Package)
+                last_step = self.routes.get(data.pipeline_name)
+                if last_step is None:
+                    logger.error(f"Package of {data.pipeline_name} arrived after the pipeline was removed, dropped.")
+                    continue
+                if data.step_order_id == last_step:
+                    # if the Step / Scraper which sent the data is the last one in the line,
+                    # send the package to the database output queue
+                    await self.database.put(data)
+                    if data.closed_inbound:
+                        # nothing else is coming for this pipeline
+                        self.drained[data.pipeline_name].set()
+                    continue
+                # forward the package to the pipeline for internal handling.
+                await self.pipelines[data.pipeline_name].general_inbound.put(data)
 
     async def forward_to_sync_engine(self):
         """
@@ -108,32 +201,101 @@ class AsyncEngine:
         """
         while True:
             package = await self.pipeline_outbound.get()
+            if self.transport is not None and not package.closed_inbound and package.data:
+                # falls back to pickling the pages if the ring is full at the moment
+                pages = self.transport.write(package.data)
+                if pages is not None:
+                    package.data = pages
             self.outbound.put(package)
 
     async def export_to_database(self):
         """
         Exports scraped data into a database referenced by package.pipeline_name which it expects to be created
         ahead of time when initiating a pipeline.
+        Packages are handed to the WriteBehindBuffer, whose writers insert them, or to the BulkLoadSink.
         Runs indefinitely, should implement kill/pause asyncio.Event
         """
         while True:
             package = await self.database.get()
-            table_name = package.pipeline_name
-            await CORE_DATABASE.insert_scraped_data(data=package.data, table_name=table_name)
+            if self.sink is not None:
+                for loaded in await self.sink.write(package):
+                    await self.exported(loaded)
+                continue
+            await self.write_behind.add(package)
+
+    async def load_spools(self):
+        """
+        Loads the spools of BulkLoadSink that have been open for too long, however little they hold.
+        Runs indefinitely, should implement kill/pause asyncio.Event
+        """
+        while True:
+            await asyncio.sleep(SPOOL_CHECK_INTERVAL)
+            for loaded in await self.sink.load_due():
+                await self.exported(loaded)
+
+    async def exported(self, package: Package) -> None:
+        """
+        The package's data is in the database, its sources are completed in the pipeline's checkpoint.
+        """
+        table_name = package.pipeline_name
+        if table_name in self.checkpoints:
+            await self.checkpoints[table_name].advance(step=package.step_order_id, sources=package.sources or list())
+            self.finish_checkpoint(name=table_name)
+
+    def depths(self) -> dict:
+        """
+        Current depth of every queue between fetching and the database, along with the credits in flight.
+        """
+        return {
+            "credits": self.credits.report(),
+            "hosts": {host: repr(limiter) for host, limiter in self.limiter.hosts.items()},
+            "pipeline_outbound": {"packages": self.pipeline_outbound.qsize(), "bytes": self.pipeline_outbound.bytes},
+            "sync_inbound": queue_size(self.outbound),
+            "sync_outbound": self.inbound.qsize(),
+            "database": self.database.qsize(),
+            "write_behind": self.write_behind.report(),
+            "pipelines": {name: pipeline.depths() for name, pipeline in self.pipelines.items()}
+        }
+
+    async def close(self) -> None:
+        """
+        Releases the shared connection pool and the shared memory ring, writes whatever rows are still held,
+        closes checkpoints, which stay on disk for the next start.
+        """
+        await self.connections.close()
+        self.inbound.close()
+        # whatever is buffered or spooled is written before its checkpoint closes
+        await self.write_behind.flush_all()
+        if self.sink is not None:
+            for loaded in await self.sink.load_all():
+                await self.exported(loaded)
+        for checkpoint in self.checkpoints.values():
+            checkpoint.close()
+        self.checkpoints.clear()
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
 
     async def run(self) -> list:
         self.loop = get_running_loop()
         try:
             async with asyncio.TaskGroup() as group:
+                task1 = group.create_task(self.admit_pipelines())
                 task2 = group.create_task(self.track_new_pipelines())
                 task3 = group.create_task(self.forward_to_sync_engine())
                 task4 = group.create_task(self.forward_from_sync_engine())
                 task5 = group.create_task(self.export_to_database())
+                tasks = [task1, task2, task3, task4, task5]
+                if self.sink is not None:
+                    tasks.append(group.create_task(self.load_spools()))
+                else:
+                    tasks.append(group.create_task(self.write_behind.run()))
         except Exception as err:
             # in case some unhandled exceptions arise
             # since this engine is run in as Task (create_task)
             # it will not raise an error to the server event loop.
             logger.error(err)
             print(f"-------------------------TOTAL CLOSURE {err}-------------------------")
+            await self.close()
             exit(1)
-        return [item.result() for item in [task2, task3, task4, task5]]
\ No newline at end of file
+        return [item.result() for item in tasks]
\ No newline at end of file
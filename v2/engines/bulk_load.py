@@ -0,0 +1,112 @@
+import asyncio
+from pathlib import Path
+
+from app.class_models.package import Package
+from app.class_models.row_batch import RowBatch, is_records
+from app.class_models.tsv_spool import TsvSpool
+from app.logger.crow_logger import logger
+
+from crow_config import BULK_LOAD_SPOOL_PATH, BULK_LOAD_BYTES, BULK_LOAD_SECONDS
+
+
+class BulkLoadSink:
+
+    def __init__(
+            self,
+            database,
+            directory: Path = BULK_LOAD_SPOOL_PATH,
+            max_bytes: int = BULK_LOAD_BYTES,
+            max_age: float = BULK_LOAD_SECONDS
+    ):
+        """
+        :param database: MySQLDatabase the spools are loaded into.
+        :param max_bytes: a spool is loaded as soon as it holds this many bytes.
+        :param max_age: or once it's been open for this many seconds, see load_due.
+        Opt-in alternative to INSERTing every package, see BULK_LOAD. Rows are appended to a TsvSpool per table
+        and every spool is bulk loaded in one go with LOAD DATA LOCAL INFILE.
+        Packages are only considered exported once their rows are loaded, so that's when they're handed back
+        for their checkpoint to advance. Spools left over by a previous run are dropped on start,
+        the pipelines resume from their checkpoints and scrape those rows again.
+        A spool that fails to load is kept next to them as .failed, for a manual load.
+        Spools are opened, written and closed in a thread, a slow disk doesn't hold up the event loop.
+        """
+        self.database = database
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        for leftover in self.directory.glob("*.tsv"):
+            leftover.unlink()
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        # open spool of every table, along with the packages whose rows it holds
+        self.spools: dict[str, tuple[TsvSpool, list[Package]]] = dict()
+        # a spool is never closed by load_due while a package is being written into it
+        self.lock = asyncio.Lock()
+
+    def __repr__(self):
+        return f"BulkLoadSink({', '.join(repr(spool) for spool, _ in self.spools.values())})"
+
+    async def write(self, package: Package) -> list[Package]:
+        """
+        Appends the rows of a package to the spool of its table.
+        :return: packages whose rows have been loaded meanwhile, which might include this one.
+        """
+        data = package.data
+        if not isinstance(data, RowBatch):
+            if not is_records(data):
+                if data:
+                    logger.error(f"Expected records to load into {package.pipeline_name}, got {type(data).__name__}")
+                # nothing to load, it's exported as it is
+                return [package]
+            data = RowBatch.from_records(data)
+        table_name = package.pipeline_name
+        loaded = list()
+        if table_name in self.spools and self.spools[table_name][0].columns != data.columns:
+            loaded.extend(await self.load(table_name))
+        async with self.lock:
+            if table_name not in self.spools:
+                spool = await asyncio.to_thread(
+                    TsvSpool, self.directory, table_name=table_name, columns=data.columns
+                )
+                self.spools[table_name] = (spool, list())
+            spool, packages = self.spools[table_name]
+            await asyncio.to_thread(spool.write, data)
+            # the rows are on disk now, only what the checkpoint needs is kept in memory
+            package.data = None
+            packages.append(package)
+        if spool.bytes >= self.max_bytes:
+            loaded.extend(await self.load(table_name))
+        return loaded
+
+    async def load(self, table_name: str) -> list[Package]:
+        """
+        :return: packages whose rows were loaded, none if the load failed.
+        """
+        async with self.lock:
+            entry = self.spools.pop(table_name, None)
+            if entry is None:
+                # loaded by someone else while this one was waiting
+                return list()
+            spool, packages = entry
+            path = await asyncio.to_thread(spool.close)
+        try:
+            rows = await self.database.load_data_file(table_name=table_name, columns=spool.columns, path=path)
+        except Exception as err:
+            logger.error(f"Failed to load {spool!r}, kept as {path.with_suffix('.failed').name}: {err}")
+            path.replace(path.with_suffix(".failed"))
+            return list()
+        if rows != spool.rows:
+            logger.warning(f"{spool!r} loaded {rows} rows, the rest clashed with existing ones.")
+        path.unlink()
+        return packages
+
+    async def load_due(self) -> list[Package]:
+        loaded = list()
+        for table_name in [name for name, (spool, _) in self.spools.items() if spool.age >= self.max_age]:
+            loaded.extend(await self.load(table_name))
+        return loaded
+
+    async def load_all(self) -> list[Package]:
+        loaded = list()
+        for table_name in list(self.spools):
+            loaded.extend(await self.load(table_name))
+        return loaded
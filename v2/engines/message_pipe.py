@@ -0,0 +1,137 @@
+from asyncio import AbstractEventLoop, Event, get_running_loop
+from collections import deque
+from multiprocessing import Pipe
+from multiprocessing.connection import Connection
+from threading import Lock, Semaphore, Thread
+
+from app.logger.crow_logger import logger
+
+# messages received per wakeup at most, so a flood from SyncEngine doesn't starve the rest of the event loop
+MAX_DRAIN = 1000
+# messages held until AsyncEngine takes them. Beyond it the pipe is no longer read, it fills up and SyncEngine
+# blocks on put() until AsyncEngine catches up.
+MAX_PENDING = 1000
+
+
+class PipeSender:
+
+    def __init__(self, connection: Connection):
+        """
+        Writing end of a message_pipe, used from SyncEngine's process.
+        A drop-in for the mp.Queue it replaces, put() pickles the message straight into the pipe,
+        without a feeder thread in between. Blocks while the pipe is full, which holds SyncEngine back
+        for as long as AsyncEngine isn't receiving.
+        """
+        self.connection = connection
+        self.lock = Lock()
+
+    def put(self, message) -> None:
+        with self.lock:
+            self.connection.send(message)
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+class PipeReceiver:
+
+    def __init__(self, connection: Connection):
+        """
+        Reading end of a message_pipe, used from AsyncEngine's event loop.
+        The pipe is registered with the loop, whenever it becomes readable every message already in it is
+        received in one go, so a burst of results costs a single wakeup instead of a thread blocked on get()
+        per message. Loops without add_reader (the proactor one on Windows) get a reader thread instead.
+        Once MAX_PENDING messages wait for receive(), the pipe is left alone until receive() takes them,
+        so a consumer that stopped receiving holds SyncEngine back rather than letting messages pile up here.
+        """
+        self.connection = connection
+        self.messages: deque = deque()
+        self.loop: AbstractEventLoop | None = None
+        self.ready: Event | None = None
+        self.closed = False
+        # the loop's reader is removed while MAX_PENDING messages wait
+        self.paused = False
+        # the reader thread takes one for every message it receives, receive() gives them back
+        self.room: Semaphore | None = None
+
+    def qsize(self) -> int:
+        return len(self.messages)
+
+    def _start(self) -> None:
+        self.loop = get_running_loop()
+        self.ready = Event()
+        try:
+            self.loop.add_reader(self.connection.fileno(), self._drain)
+        except NotImplementedError:
+            self.room = Semaphore(MAX_PENDING)
+            Thread(target=self._read_blocking, daemon=True).start()
+
+    def _drain(self) -> None:
+        received = 0
+        try:
+            # poll() is true as soon as the first bytes of a message arrived, recv() then waits for the rest,
+            # which the sender is writing at that very moment
+            while received < MAX_DRAIN and len(self.messages) < MAX_PENDING and self.connection.poll():
+                self.messages.append(self.connection.recv())
+                received += 1
+        except (EOFError, OSError) as err:
+            logger.error(f"SyncEngine closed its end of the pipe: {err!r}")
+            self.loop.remove_reader(self.connection.fileno())
+            self.closed = True
+        if not self.closed and len(self.messages) >= MAX_PENDING:
+            self.loop.remove_reader(self.connection.fileno())
+            self.paused = True
+        if self.messages:
+            self.ready.set()
+
+    def _read_blocking(self) -> None:
+        while True:
+            self.room.acquire()
+            try:
+                message = self.connection.recv()
+            except (EOFError, OSError) as err:
+                logger.error(f"SyncEngine closed its end of the pipe: {err!r}")
+                self.closed = True
+                return
+            self.loop.call_soon_threadsafe(self._push, message)
+
+    def _push(self, message) -> None:
+        self.messages.append(message)
+        self.ready.set()
+
+    async def receive(self) -> list:
+        """
+        :return: every message received so far, waits for at least one.
+        Once the pipe is closed it waits indefinitely, nothing else is ever going to arrive.
+        """
+        if self.loop is None:
+            self._start()
+        while not self.messages:
+            self.ready.clear()
+            await self.ready.wait()
+        messages = list(self.messages)
+        self.messages.clear()
+        if self.room is not None:
+            self.room.release(len(messages))
+        if self.paused and not self.closed:
+            self.paused = False
+            self.loop.add_reader(self.connection.fileno(), self._drain)
+        return messages
+
+    def close(self) -> None:
+        if self.loop is not None and not self.closed and not self.paused:
+            try:
+                self.loop.remove_reader(self.connection.fileno())
+            except NotImplementedError:
+                pass
+        self.closed = True
+        self.connection.close()
+
+
+def message_pipe() -> tuple[PipeReceiver, PipeSender]:
+    """
+    One way channel from SyncEngine back to AsyncEngine.
+    :return: the receiving end for AsyncEngine and the sending end for SyncEngine.
+    """
+    receiving, sending = Pipe(duplex=False)
+    return PipeReceiver(receiving), PipeSender(sending)
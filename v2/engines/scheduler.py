@@ -0,0 +1,63 @@
+from asyncio import Condition
+from heapq import heappush, heappop
+from itertools import count
+
+from app.class_models.pipeline import ScrapingPipeline
+from app.class_models.fair_share import FairShare, FairQueue
+
+# the number of concurrent pipelines being handled. This is in order to control the stress on the machine.
+# I run a very old laptop and its not fun having more than 5 concurrent pipelines.
+MAX_WORKERS = 5
+# requests in flight across all pipelines, split between running pipelines by their priority
+GLOBAL_FETCH_SLOTS = 256
+# bytes of pages waiting in the queue towards SyncEngine before Scrapers block on handing more on
+OUTBOUND_QUEUE_BYTES = 64 * 1024 * 1024
+
+
+class PipelineScheduler:
+
+    def __init__(
+            self,
+            max_pipelines: int = MAX_WORKERS,
+            fetch_slots: int = GLOBAL_FETCH_SLOTS,
+            outbound_bytes: int = OUTBOUND_QUEUE_BYTES
+    ):
+        """
+        Admits pipelines as soon as a slot frees up, the highest priority first and first come first served
+        among equal priorities. Running pipelines share the global fetch capacity (fetch) and the extraction
+        capacity (outbound, the queue towards SyncEngine) in proportion to their priority.
+        """
+        self.max_pipelines = max_pipelines
+        self.running: set[str] = set()
+        self.waiting: list[tuple[int, int, ScrapingPipeline]] = list()
+        self.weights: dict[str, float] = dict()
+        self.fetch = FairShare(capacity=fetch_slots, weights=self.weights)
+        self.outbound = FairQueue(weights=self.weights, max_bytes=outbound_bytes)
+        self.condition = Condition()
+        self._order = count()
+
+    def __repr__(self):
+        return f"running={sorted(self.running)} waiting={len(self.waiting)} fetch={self.fetch!r}"
+
+    async def submit(self, pipeline: ScrapingPipeline) -> None:
+        async with self.condition:
+            heappush(self.waiting, (-pipeline.priority, next(self._order), pipeline))
+            self.condition.notify_all()
+
+    async def admit(self) -> ScrapingPipeline:
+        """
+        Waits until there's both a free slot and a waiting pipeline, returns the pipeline to run.
+        """
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.waiting and len(self.running) < self.max_pipelines)
+            _, _, pipeline = heappop(self.waiting)
+            self.running.add(pipeline.profile.name)
+            self.weights[pipeline.profile.name] = float(pipeline.priority)
+            return pipeline
+
+    async def release(self, pipeline: ScrapingPipeline) -> None:
+        async with self.condition:
+            self.running.discard(pipeline.profile.name)
+            self.weights.pop(pipeline.profile.name, None)
+            self.outbound.forget(pipeline.profile.name)
+            self.condition.notify_all()
@@ -0,0 +1,120 @@
+from collections import deque
+from multiprocessing import resource_tracker, get_start_method
+from multiprocessing.shared_memory import SharedMemory
+
+from app.logger.crow_logger import logger
+
+# size of the ring the pages are written into. Keep it below the size of /dev/shm, 64 MB in docker by default.
+# Packages that don't fit while the ring is full simply travel the regular, pickled way.
+RING_SIZE = 48 * 1024 * 1024
+
+# segments attached to by the current process, by name. Only used on the reading side.
+_ATTACHED: dict[str, SharedMemory] = dict()
+
+
+class SharedPages:
+
+    def __init__(self, name: str, offset: int, lengths: list[int]):
+        """
+        :param name: name of the shared memory segment.
+        :param offset: where in the segment the pages start.
+        :param lengths: byte length of every page, the pages are written one after the other.
+        Stands in for Package.data between AsyncEngine and SyncEngine, so only these few numbers get pickled.
+        SyncEngine sends it back once the pages have been extracted, which frees its place in the ring.
+        """
+        self.name = name
+        self.offset = offset
+        self.lengths = lengths
+
+    def __len__(self):
+        return len(self.lengths)
+
+    @property
+    def size(self) -> int:
+        return sum(self.lengths)
+
+    def read(self) -> list[str]:
+        memory = _ATTACHED.get(self.name)
+        if memory is None:
+            memory = SharedMemory(name=self.name)
+            # the segment belongs to AsyncEngine, this process must not unlink it on its way out.
+            # Forked processes share AsyncEngine's resource tracker, which already knows about the segment.
+            if get_start_method() != "fork":
+                resource_tracker.unregister(memory._name, "shared_memory")
+            _ATTACHED[self.name] = memory
+        pages = list()
+        start = self.offset
+        for length in self.lengths:
+            pages.append(bytes(memory.buf[start:start + length]).decode())
+            start += length
+        return pages
+
+
+class SharedMemoryRing:
+
+    def __init__(self, size: int = RING_SIZE):
+        """
+        Writer side of the transport, owned by AsyncEngine. Space is handed out in order around the ring and
+        reclaimed from the oldest allocation on, as soon as it and everything before it has been freed.
+        Allocations may be freed in any order, extraction workers don't finish in order either.
+        """
+        self.size = size
+        self.memory = SharedMemory(create=True, size=size)
+        self.head = 0
+        # [offset, size, freed] in allocation order
+        self.allocations: deque[list] = deque()
+        self.by_offset: dict[int, list] = dict()
+
+    def __repr__(self):
+        return f"{self.memory.name} {sum(x[1] for x in self.allocations)}/{self.size} bytes in use"
+
+    def _allocate(self, size: int) -> int | None:
+        size = max(size, 1)
+        if not self.allocations:
+            self.head = 0
+        if size > self.size:
+            return None
+        tail = self.allocations[0][0] if self.allocations else 0
+        if not self.allocations or self.head > tail:
+            # free space is [head, end) and [0, tail)
+            if self.head + size <= self.size:
+                offset = self.head
+            elif size <= tail:
+                offset = 0
+            else:
+                return None
+        elif self.head + size <= tail:
+            # wrapped around, free space is [head, tail)
+            offset = self.head
+        else:
+            return None
+        allocation = [offset, size, False]
+        self.allocations.append(allocation)
+        self.by_offset[offset] = allocation
+        self.head = offset + size
+        return offset
+
+    def write(self, pages: list[str]) -> SharedPages | None:
+        """
+        Copies the pages into the ring, returns None if there's no room for them at the moment.
+        """
+        encoded = [page.encode() for page in pages]
+        block = b"".join(encoded)
+        offset = self._allocate(len(block))
+        if offset is None:
+            return None
+        self.memory.buf[offset:offset + len(block)] = block
+        return SharedPages(name=self.memory.name, offset=offset, lengths=[len(page) for page in encoded])
+
+    def free(self, pages: SharedPages) -> None:
+        allocation = self.by_offset.pop(pages.offset, None)
+        if allocation is None or pages.name != self.memory.name:
+            logger.error(f"{self!r} was asked to free an unknown allocation at {pages.offset}.")
+            return
+        allocation[2] = True
+        while self.allocations and self.allocations[0][2]:
+            self.allocations.popleft()
+
+    def close(self) -> None:
+        self.memory.close()
+        self.memory.unlink()
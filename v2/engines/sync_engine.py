@@ -1,23 +1,203 @@
+import os
+import signal
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from itertools import chain
-from multiprocessing import Queue as SyncQueue
+from collections import deque
+from multiprocessing import Queue as SyncQueue, Process
+from queue import Empty
+from threading import Thread, Lock
+from time import monotonic
 from app.class_models.package import Package
 from app.class_models.selector import SelectorList
+from app.class_models.extraction_plan import ExtractionPlan
+from app.class_models.extraction_cache import ExtractionCache
+from app.class_models.flow_control import Credit
+from app.class_models.row_batch import RowBatch, is_records
 
 from app.logger.crow_logger import logger
+from crow_config import EXTRACTION_CACHE_SIZE, EXTRACTION_CACHE_PATH
+
+from engines.shared_memory_transport import SharedPages
+from engines.message_pipe import PipeSender
+
+# the extraction pool never shrinks below MIN_WORKERS and never grows past MAX_WORKERS processes
+MIN_WORKERS = 1
+MAX_WORKERS = os.cpu_count() or 1
+# a worker is added once there are more than this many packages waiting per worker,
+# and one is retired once there's less than one package per worker
+SCALE_UP_DEPTH = 2
+# seconds between two scaling decisions, so a burst doesn't make the pool flap
+SCALE_INTERVAL = 5.0
+# threads extracting the pages of a package in parallel within every worker. lxml parses without holding the GIL,
+# so they make use of additional cores without additional processes. 1 extracts in the worker's own thread.
+EXTRACTION_THREADS = 1
+# seconds between two reports of the extraction cache hit rate
+CACHE_REPORT_INTERVAL = 60.0
+# packages handed to a worker ahead of the one it's extracting, the rest wait in the engine for the first free worker
+WORKER_PREFETCH = 2
+# seconds between two looks for workers that died
+REAP_INTERVAL = 1.0
+# times a package is handed to a worker. Once its worker died that many times, it's failed instead of retried.
+MAX_DISPATCHES = 2
+
+
+def register_plan(plans: dict[tuple[str, int], ExtractionPlan], plan: ExtractionPlan) -> None:
+    if plan.selectors is None:
+        plans.pop(plan.plan_id, None)
+    else:
+        plans[plan.plan_id] = plan
+
+
+def extraction_worker(
+        tasks: SyncQueue,
+        results: SyncQueue,
+        plans: dict[tuple[str, int], ExtractionPlan],
+        cache_size: int = 0,
+        cache_path: str | None = None,
+        threads: int = EXTRACTION_THREADS
+) -> None:
+    """
+    :param tasks: this worker's own queue of (token, package), the engine keeps track of what each worker holds.
+    Every ExtractionPlan registered with the engine arrives through it as well, ahead of the packages it's for.
+    :param plans: plans registered before the worker started.
+    :param cache_size: entries of the worker's ExtractionCache, the cache is off if it's 0 and there's no cache_path.
+    :param threads: extraction threads of the worker, see EXTRACTION_THREADS.
+    Body of a single extraction process. Takes packages until it receives None, which retires it.
+    Every package is answered by its token, with None if nothing came out of it, so the engine can keep count.
+    Answers carry the pid and the cache statistics of the worker as well.
+    """
+    cache = ExtractionCache(capacity=cache_size, path=cache_path) if cache_size or cache_path else None
+    pool = ThreadPoolExecutor(max_workers=threads) if threads > 1 else None
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        if isinstance(task, ExtractionPlan):
+            register_plan(plans=plans, plan=task)
+            continue
+        token, package = task
+        # plans come down the same queue before their packages, one missing has been withdrawn or was never sent
+        plan = plans.get(package.plan_id)
+        if plan is None:
+            logger.error(f"No ExtractionPlan registered for {package.plan_id}, package failed.")
+            processed = None
+        else:
+            try:
+                processed = SyncEngine.process_package(
+                    package=package, selectors=plan.compiled, cache=cache, version=plan.version, pool=pool
+                )
+            except Exception as err:
+                logger.error(err)
+                processed = None
+        stats = cache.stats() if cache is not None else None
+        results.put((os.getpid(), token, processed, stats))
+
+
+class WorkerHandle:
+
+    def __init__(self, process: Process, tasks: SyncQueue):
+        """
+        An extraction_worker as seen from the engine, along with the packages it holds.
+        """
+        self.process = process
+        self.tasks = tasks
+        # packages handed to the worker and not answered yet, by token
+        self.in_flight: dict[int, Package] = dict()
+        # sent None, takes no more packages
+        self.retiring = False
+        # holds a package handed back by a dead worker, takes no other until it's answered
+        self.isolated = False
 
 
 class SyncEngine:
 
-    def __init__(self, inbound: SyncQueue, outbound: SyncQueue):
+    def __init__(
+            self,
+            inbound: SyncQueue,
+            outbound: PipeSender,
+            min_workers: int = MIN_WORKERS,
+            max_workers: int = MAX_WORKERS,
+            cache_size: int = EXTRACTION_CACHE_SIZE,
+            cache_path: str | None = EXTRACTION_CACHE_PATH,
+            threads: int = EXTRACTION_THREADS
+    ):
         """
         SyncEngine that is supposed to be run in a separate process.
         Thought of as a hub of all CPU bound tasks, but currently only does extraction.
+        Extraction runs on a pool of worker processes that scales between min_workers and max_workers
+        with the amount of packages waiting. Every worker is handed at most WORKER_PREFETCH packages at a time,
+        so the engine knows which packages a worker held if it dies. They're handed to another worker,
+        up to MAX_DISPATCHES times. Packages are processed in any order, the only ordering kept is
+        that a closing package of a (pipeline, step) is sent out after every package of that step has been.
+        Every worker keeps an ExtractionCache of cache_size entries, backed by cache_path on disk if given,
+        and extracts the pages of a package on as many threads as given.
         """
         self.inbound = inbound
         self.outbound = outbound
+        self.min_workers = min_workers
+        self.max_workers = max(max_workers, min_workers)
+        self.cache_size = cache_size
+        self.cache_path = str(cache_path) if cache_path is not None else None
+        self.threads = threads
+        # latest cache statistics of every worker, by pid
+        self.cache_stats: dict[int, dict] = dict()
+        self.last_reported = monotonic()
+        # created in initiate, they belong to the process the engine runs in
+        self.results: SyncQueue | None = None
+        self.workers: dict[int, WorkerHandle] = dict()
+        # packages waiting for a worker with room, along with their token
+        self.pending: deque[tuple[int, Package]] = deque()
+        self.last_token = 0
+        # times every unanswered package has been handed to a worker, by token
+        self.dispatches: dict[int, int] = dict()
+        self.last_reaped = monotonic()
+        # every registered ExtractionPlan, handed to workers started later on
+        self.plans: dict[tuple[str, int], ExtractionPlan] = dict()
+        # workers taking packages, retiring ones excluded
+        self.size = 0
+        self.last_scaled = 0.0
+        # packages handed to workers and not answered yet, per (pipeline, step)
+        self.outstanding: dict[tuple[str, int], int] = dict()
+        # closing packages held back until their step has no outstanding packages
+        self.closing: dict[tuple[str, int], Package] = dict()
+        self.lock = Lock()
+
+    @staticmethod
+    def extract_page(
+            text: str,
+            selectors: SelectorList,
+            cache: ExtractionCache | None = None,
+            version: str | None = None
+    ) -> list[dict]:
+        """
+        Records of a single page, taken from the cache if this very page was extracted by the same plan before.
+        """
+        if cache is None or version is None or not isinstance(text, str):
+            key = None
+        else:
+            key = cache.key(version=version, page=text)
+            records = cache.get(key)
+            if records is not None:
+                return records
+        if selectors.row is not None:
+            # a record per row container rather than per page
+            records = selectors.extract_rows(data=text)
+        else:
+            records = [selectors.extract(data=text)]
+        if key is not None:
+            cache.put(key, records)
+        return records
 
     @staticmethod
-    def extract(data: list, selectors: SelectorList) -> None | list | str:
+    def extract(
+            data: list,
+            selectors: SelectorList,
+            cache: ExtractionCache | None = None,
+            version: str | None = None,
+            pool: ThreadPoolExecutor | None = None
+    ) -> None | list | str:
         """
         There are 3 implicit extraction options given within provided selectors.
             1) first
@@ -28,7 +208,8 @@ class SyncEngine:
         Returns flattened list, since I used it predominantly for url extraction.
         If needed be, raise an issue on GitHub so that I could implement additional features.
         For instance, if a website has many *primary* items on one page, instead of having
-        a single page per item (ebay, amazon...)
+        a single page per item (ebay, amazon...). That's what a RowSelector is for, it yields a record,
+        a row of the table, per item on the page instead of one per page.
         3) Specifically used to send data to the following Scraper based on input.
         For instance, if you need to format your urls with the data from a single page,
         you could do it by making a CrowSelector with REUSE as its name, and input the adequate post_processor
@@ -36,15 +217,18 @@ class SyncEngine:
         I have an idea to completely overhaul this logic using parsel only, with all cool features,
         but I simply lack time at the moment.
         """
-        # all selectors must have the same method
-        protocol = selectors[0].method
         try:
-            data = [dict(selectors.extract(data=text)) for text in data]
+            protocol = selectors.protocol
+            extract_page = partial(SyncEngine.extract_page, selectors=selectors, cache=cache, version=version)
+            # SelectorList is stateless, any number of pages can be extracted with it at once
+            pages = pool.map(extract_page, data) if pool is not None and len(data) > 1 else map(extract_page, data)
+            records = list(chain.from_iterable(pages))
+            data = selectors.post_process_columns(records)
         except TypeError as err:
             logger.error(err)
             return
         if protocol == "first":
-            if selectors[0].name == "REUSE":
+            if selectors.fields and selectors.fields[0].name == "REUSE":
                 if len(data) == 1:
                     return data[0]["REUSE"]
             return data
@@ -58,37 +242,238 @@ class SyncEngine:
                 )
             )
 
-    def process_package(self, package: Package):
+    @staticmethod
+    def process_package(
+            package: Package,
+            selectors: SelectorList,
+            cache: ExtractionCache | None = None,
+            version: str | None = None,
+            pool: ThreadPoolExecutor | None = None
+    ) -> Package | None:
         """
         Extracts data off the provided html and returns data wrapped in the Package to its adequate sender.
         """
-        if package.data is None and package.selectors is None:
+        if package.data is None:
             return
-        processed_data = self.extract(data=package.data, selectors=package.selectors)
+        # a package whose pages all failed still has to travel back, so its sources get checkpointed
+        if not package.data:
+            processed_data = list()
+        else:
+            pages = package.data.read() if isinstance(package.data, SharedPages) else package.data
+            processed_data = SyncEngine.extract(
+                data=pages, selectors=selectors, cache=cache, version=version, pool=pool
+            )
         if processed_data is None:
             return
-        self.outbound.put(
-            Package(
-                pipeline_name=package.pipeline_name,
-                step_order_id=package.step_order_id,
-                data=processed_data,
-                closed_inbound=package.closed_inbound
-            )
+        if is_records(processed_data):
+            # names once per batch rather than once per record, cheaper to send back and to insert
+            processed_data = RowBatch.from_records(processed_data)
+        return Package(
+            pipeline_name=package.pipeline_name,
+            step_order_id=package.step_order_id,
+            data=processed_data,
+            closed_inbound=package.closed_inbound,
+            sources=package.sources
         )
-        return
+
+    def scale(self) -> None:
+        """
+        Adds or retires a single worker depending on the amount of outstanding packages.
+        Only an idle worker is retired, so no package is left behind with it.
+        Expects self.lock to be held.
+        """
+        now = monotonic()
+        if self.size >= self.min_workers and now - self.last_scaled < SCALE_INTERVAL:
+            return
+        depth = sum(self.outstanding.values())
+        if self.size < self.min_workers or (depth > self.size * SCALE_UP_DEPTH and self.size < self.max_workers):
+            tasks = SyncQueue()
+            process = Process(
+                target=extraction_worker,
+                args=(tasks, self.results, dict(self.plans), self.cache_size, self.cache_path, self.threads),
+                daemon=True
+            )
+            process.start()
+            self.workers[process.pid] = WorkerHandle(process=process, tasks=tasks)
+            self.size += 1
+        elif depth < self.size and self.size > self.min_workers:
+            idle = [worker for worker in self.workers.values() if not worker.retiring and not worker.in_flight]
+            if not idle:
+                return
+            idle[0].retiring = True
+            idle[0].tasks.put(None)
+            self.size -= 1
+        else:
+            return
+        self.last_scaled = now
+        logger.info(f"Extraction pool scaled to {self.size} workers at {depth} outstanding packages.")
+
+    def dispatch(self) -> None:
+        """
+        Hands waiting packages to the workers holding the fewest.
+        Expects self.lock to be held.
+        """
+        while self.pending:
+            token, package = self.pending[0]
+            # a package handed back by a dead worker goes to an idle one and alone, so if it's the culprit
+            # it doesn't take anything else down with it the next time
+            alone = token in self.dispatches
+            ready = [
+                worker for worker in self.workers.values()
+                if not worker.retiring and not worker.isolated
+                and len(worker.in_flight) < (1 if alone else WORKER_PREFETCH)
+            ]
+            if not ready:
+                return
+            worker = min(ready, key=lambda x: len(x.in_flight))
+            self.pending.popleft()
+            worker.isolated = alone
+            worker.in_flight[token] = package
+            self.dispatches[token] = self.dispatches.get(token, 0) + 1
+            worker.tasks.put((token, package))
+
+    def reap(self) -> None:
+        """
+        Drops workers that died. Whatever they held is handed to another worker,
+        or failed if it's been handed out MAX_DISPATCHES times already, a package that takes down every worker
+        it's given to shouldn't take the whole pool down with it.
+        Expects self.lock to be held, and every answer already sent by the dead workers to be collected.
+        """
+        for pid, worker in list(self.workers.items()):
+            if worker.process.is_alive():
+                continue
+            self.workers.pop(pid)
+            if worker.retiring:
+                continue
+            self.size -= 1
+            logger.error(f"Extraction worker {pid} died with exit code {worker.process.exitcode}, "
+                         f"{len(worker.in_flight)} packages it held are handed back.")
+            for token, package in worker.in_flight.items():
+                if self.dispatches[token] >= MAX_DISPATCHES:
+                    logger.error(f"Package of {package.plan_id} took down {MAX_DISPATCHES} workers, it's failed.")
+                    self.answer(token=token, package=package, processed=None)
+                else:
+                    self.pending.appendleft((token, package))
+
+    def answer(self, token: int, package: Package, processed: Package | None) -> None:
+        """
+        Sends out whatever came out of a package, frees its pages and returns its credits.
+        Releases the closing package of its step once the step has nothing outstanding.
+        Expects self.lock to be held.
+        """
+        self.dispatches.pop(token, None)
+        key = package.plan_id
+        if processed is not None:
+            self.outbound.put(processed)
+        if isinstance(package.data, SharedPages):
+            self.outbound.put(package.data)
+        if package.charged:
+            self.outbound.put(Credit(pipeline_name=key[0], size=package.charged))
+        self.outstanding[key] -= 1
+        if not self.outstanding[key]:
+            self.outstanding.pop(key)
+            if key in self.closing:
+                self.outbound.put(self.closing.pop(key))
+                self.register(ExtractionPlan(pipeline_name=key[0], step_order_id=key[1], selectors=None))
+
+    def register(self, plan: ExtractionPlan) -> None:
+        """
+        Registers the plan with every worker, or withdraws it if it has no selectors.
+        Expects self.lock to be held.
+        """
+        register_plan(plans=self.plans, plan=plan)
+        for worker in self.workers.values():
+            worker.tasks.put(plan)
+
+    def cache_report(self) -> dict:
+        """
+        Extraction cache statistics summed over the workers, retired ones included.
+        """
+        report = {"hits": 0, "disk_hits": 0, "misses": 0, "entries": 0}
+        for stats in self.cache_stats.values():
+            for name, value in stats.items():
+                report[name] += value
+        lookups = report["hits"] + report["disk_hits"] + report["misses"]
+        report["hit_rate"] = (report["hits"] + report["disk_hits"]) / lookups if lookups else 0.0
+        return report
+
+    def collected(self, pid: int, token: int, processed: Package | None, stats: dict | None) -> None:
+        """
+        Expects self.lock to be held.
+        """
+        if stats is not None:
+            self.cache_stats[pid] = stats
+            if monotonic() - self.last_reported > CACHE_REPORT_INTERVAL:
+                self.last_reported = monotonic()
+                logger.info(f"Extraction cache: {self.cache_report()}")
+        worker = self.workers.get(pid)
+        package = worker.in_flight.pop(token, None) if worker is not None else None
+        if package is None:
+            # its worker had already been given up on, the package was handed to another one
+            return
+        if not worker.in_flight:
+            worker.isolated = False
+        self.answer(token=token, package=package, processed=processed)
+
+    def collect(self) -> None:
+        """
+        Runs in a thread. Forwards processed packages and releases closing packages whose step is done.
+        Every extracted package is followed by the Credit that returns its bytes to AsyncEngine's CreditPool.
+        Every REAP_INTERVAL, whatever answers are waiting are collected and dead workers are replaced.
+        """
+        while True:
+            try:
+                answers = [self.results.get(timeout=REAP_INTERVAL)]
+            except Empty:
+                answers = list()
+            reaping = monotonic() - self.last_reaped >= REAP_INTERVAL
+            if reaping:
+                # a worker might have answered right before dying, such answers are collected first
+                while True:
+                    try:
+                        answers.append(self.results.get_nowait())
+                    except Empty:
+                        break
+            with self.lock:
+                for pid, token, processed, stats in answers:
+                    self.collected(pid=pid, token=token, processed=processed, stats=stats)
+                if reaping:
+                    self.reap()
+                    self.last_reaped = monotonic()
+                self.scale()
+                self.dispatch()
 
     def initiate(self):
         """
         Runs indefinitely as per design, however, this should include kill/pause multiprocessing Events.
         """
+        # exiting normally on terminate lets multiprocessing take the daemonic workers down as well
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+        self.results = SyncQueue()
+        with self.lock:
+            while self.size < self.min_workers:
+                self.scale()
+        Thread(target=self.collect, daemon=True).start()
         while True:
             package = self.inbound.get()
+            if isinstance(package, ExtractionPlan):
+                with self.lock:
+                    self.register(package)
+                continue
             if not isinstance(package, Package):
                 continue
-            else:
+            key = package.plan_id
+            with self.lock:
                 if package.closed_inbound is True:
-                    self.outbound.put(package)
+                    if key in self.outstanding:
+                        self.closing[key] = package
+                    else:
+                        self.outbound.put(package)
+                        self.register(ExtractionPlan(pipeline_name=key[0], step_order_id=key[1], selectors=None))
                     continue
-                self.process_package(package)
-                continue
+                self.outstanding[key] = self.outstanding.get(key, 0) + 1
+                self.last_token += 1
+                self.pending.append((self.last_token, package))
+                self.scale()
+                self.dispatch()
         return
@@ -0,0 +1,205 @@
+import asyncio
+from asyncio import Condition, Queue as AsyncQueue
+from bisect import bisect_right
+from collections import Counter
+from time import monotonic
+from typing import Awaitable, Callable
+
+from app.class_models.package import Package
+from app.class_models.row_batch import RowBatch, is_records
+from app.logger.crow_logger import logger
+
+# a table's rows are written once this many are buffered, whichever of the three comes first
+FLUSH_ROWS = 5000
+FLUSH_BYTES = 8 * 1024 * 1024
+# seconds the first rows of a buffer wait for more at most
+FLUSH_AGE = 2.0
+# flushes running at once, each in its own session, so a slow commit holds up a single writer
+WRITERS = 4
+# rows held across tables, buffered, waiting for a writer or being written. Packages wait for room beyond it.
+MAX_BUFFERED_BYTES = 64 * 1024 * 1024
+
+
+def batch_bytes(batch: RowBatch) -> int:
+    # characters of the text values, the rest is too small to matter
+    return sum(len(value) for column in batch.values for value in column if isinstance(value, str))
+
+
+class TableBuffer:
+
+    def __init__(self, table_name: str, columns: tuple[str, ...]):
+        """
+        Rows of consecutive packages bound to the same table, coalesced into a single RowBatch.
+        """
+        self.table_name = table_name
+        self.columns = columns
+        self.values: list[list] = [list() for _ in columns]
+        self.rows = 0
+        self.bytes = 0
+        self.created = monotonic()
+        # handed back once the rows are written, for their checkpoint to advance
+        self.packages: list[Package] = list()
+        # index of the first row of every package within the buffer, to tell whose rows failed
+        self.starts: list[int] = list()
+
+    def __repr__(self):
+        return f"TableBuffer({self.table_name}, {self.rows} rows, {self.bytes} bytes)"
+
+    @property
+    def age(self) -> float:
+        return monotonic() - self.created
+
+    def add(self, package: Package, batch: RowBatch, size: int) -> None:
+        for column, values in zip(self.values, batch.values):
+            column.extend(values)
+        self.rows += len(batch)
+        self.bytes += size
+        # the rows live in the buffer now, only what the checkpoint needs is kept
+        package.data = None
+        self.packages.append(package)
+        self.starts.append(self.rows - len(batch))
+
+    def batch(self) -> RowBatch:
+        return RowBatch(columns=self.columns, values=self.values)
+
+    def holding(self, rows: list[int]) -> Counter:
+        """
+        :return: rows among the given indices per position of the package they came from.
+        """
+        # a package without rows shares its start with the next one, which is the one holding the row
+        return Counter(bisect_right(self.starts, row) - 1 for row in rows)
+
+
+class WriteBehindBuffer:
+
+    def __init__(
+            self,
+            write: Callable[..., Awaitable],
+            on_written: Callable[[Package], Awaitable],
+            writers: int = WRITERS,
+            max_rows: int = FLUSH_ROWS,
+            max_bytes: int = FLUSH_BYTES,
+            max_age: float = FLUSH_AGE,
+            capacity: int = MAX_BUFFERED_BYTES
+    ):
+        """
+        :param write: writes the rows of a table given as data and table_name, MySQLDatabase.insert_scraped_data.
+        Returns the index and error of every row it couldn't write.
+        :param on_written: called with every package once its rows are written.
+        :param writers: flushes running concurrently.
+        :param capacity: bytes of rows held at most, see MAX_BUFFERED_BYTES.
+        Sits between the database queue and the database. Rows of packages headed for the same table are coalesced
+        until max_rows, max_bytes or max_age, and the whole buffer is written as one batch by one of the writers.
+        Tiny packages, REUSE and first method steps, no longer cost a transaction each, and pipelines don't wait
+        on each other's commits. Once capacity is reached, add() waits for the writers to catch up, which in turn
+        backs the database queue up.
+        A flush that fails is logged and its packages are not reported written, so their checkpoint
+        keeps their sources unfinished and the rows are scraped again on resume. The same goes for
+        every package with a row that the write reports failed, the rest of the flush is reported written.
+        """
+        self.write = write
+        self.on_written = on_written
+        self.writers = writers
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.capacity = capacity
+        self.tables: dict[str, TableBuffer] = dict()
+        self.flushes: AsyncQueue[TableBuffer] = AsyncQueue()
+        self.buffered = 0
+        self.room = Condition()
+
+    def __repr__(self):
+        return f"WriteBehindBuffer({self.buffered}/{self.capacity} bytes, {self.flushes.qsize()} flushes waiting)"
+
+    def report(self) -> dict:
+        return {
+            "bytes": self.buffered,
+            "capacity": self.capacity,
+            "waiting_flushes": self.flushes.qsize(),
+            "tables": {name: buffer.rows for name, buffer in self.tables.items()}
+        }
+
+    async def add(self, package: Package) -> None:
+        data = package.data
+        if not isinstance(data, RowBatch):
+            if not is_records(data):
+                if data:
+                    logger.error(f"Expected records to write into {package.pipeline_name}, got {type(data).__name__}")
+                # nothing to write, but the package still has sources to checkpoint
+                await self.on_written(package)
+                return
+            data = RowBatch.from_records(data)
+        size = batch_bytes(data)
+        async with self.room:
+            if self.buffered and self.buffered + size > self.capacity:
+                # whatever sits in open buffers is only freed once written, so they're written right away
+                for table_name in list(self.tables):
+                    self.seal(table_name)
+                await self.room.wait_for(lambda: not self.buffered or self.buffered + size <= self.capacity)
+            self.buffered += size
+        table_name = package.pipeline_name
+        buffer = self.tables.get(table_name)
+        if buffer is not None and buffer.columns != data.columns:
+            self.seal(table_name)
+            buffer = None
+        if buffer is None:
+            buffer = self.tables[table_name] = TableBuffer(table_name=table_name, columns=data.columns)
+        buffer.add(package=package, batch=data, size=size)
+        if buffer.rows >= self.max_rows or buffer.bytes >= self.max_bytes:
+            self.seal(table_name)
+
+    def seal(self, table_name: str) -> None:
+        buffer = self.tables.pop(table_name, None)
+        if buffer is not None:
+            self.flushes.put_nowait(buffer)
+
+    async def flush(self, buffer: TableBuffer) -> None:
+        try:
+            failed = await self.write(data=buffer.batch(), table_name=buffer.table_name)
+            held = buffer.holding([index for index, _ in failed or ()])
+            for position, package in enumerate(buffer.packages):
+                if position in held:
+                    logger.error(f"{held[position]} rows of {package!r} were not written, its checkpoint stays.")
+                    continue
+                await self.on_written(package)
+        except Exception as err:
+            logger.error(f"Failed to write {buffer!r}: {err}")
+        finally:
+            async with self.room:
+                self.buffered -= buffer.bytes
+                self.room.notify_all()
+
+    async def writer(self) -> None:
+        while True:
+            buffer = await self.flushes.get()
+            try:
+                await self.flush(buffer)
+            finally:
+                self.flushes.task_done()
+
+    async def seal_due(self) -> None:
+        while True:
+            await asyncio.sleep(self.max_age / 4)
+            for table_name in [name for name, buffer in self.tables.items() if buffer.age >= self.max_age]:
+                self.seal(table_name)
+
+    async def run(self) -> None:
+        """
+        Runs the writers along with the timer sealing buffers that waited long enough, indefinitely.
+        """
+        async with asyncio.TaskGroup() as group:
+            for _ in range(self.writers):
+                group.create_task(self.writer())
+            group.create_task(self.seal_due())
+
+    async def flush_all(self) -> None:
+        """
+        Writes everything still held, without the writers, which are expected to be stopped by now.
+        """
+        for table_name in list(self.tables):
+            self.seal(table_name)
+        while not self.flushes.empty():
+            buffer = self.flushes.get_nowait()
+            await self.flush(buffer)
+            self.flushes.task_done()
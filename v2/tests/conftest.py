@@ -0,0 +1,82 @@
+import re
+from pathlib import Path
+
+import pytest
+
+# LOAD DATA ... FIELDS TERMINATED BY '\t' ESCAPED BY '\\' LINES TERMINATED BY '\n', the way MySQL reads it
+TOKEN = re.compile(r"\\(.)|(\t)|(\n)|([^\\\t\n]+)", re.DOTALL)
+UNESCAPED = {"0": "\0", "b": "\b", "n": "\n", "r": "\r", "t": "\t", "Z": "\x1a"}
+
+
+def read_field(parts: list[str | None]) -> str | None:
+    # \N stands for NULL only as the whole field, anywhere else it's a plain N
+    if parts == [None]:
+        return None
+    return "".join("N" if part is None else part for part in parts)
+
+
+def read_rows(text: str) -> list[list[str | None]]:
+    rows = list()
+    row: list[str | None] = list()
+    parts: list[str | None] = list()
+    for escaped, tab, newline, chars in TOKEN.findall(text):
+        if escaped:
+            parts.append(None if escaped == "N" else UNESCAPED.get(escaped, escaped))
+        elif tab:
+            row.append(read_field(parts))
+            parts = list()
+        elif newline:
+            row.append(read_field(parts))
+            rows.append(row)
+            row, parts = list(), list()
+        else:
+            parts.append(chars)
+    if row or parts:
+        # the last line doesn't need its terminator
+        row.append(read_field(parts))
+        rows.append(row)
+    return rows
+
+
+class LoadDataStandIn:
+
+    def __init__(self):
+        """
+        Stands in for MySQLDatabase where only load_data_file is needed, no server involved.
+        The spool is read the way MySQL reads it with the clauses load_data_file uses. Missing fields are NULL,
+        extra ones are dropped and rows clashing with the unique column are skipped, as with LOCAL.
+        """
+        self.tables: dict[str, tuple[tuple[str, ...], str | None, list[dict]]] = dict()
+        self.loads: list[Path] = list()
+
+    def create_table(self, table_name: str, columns: tuple[str, ...], unique: str | None = None) -> None:
+        self.tables[table_name] = (columns, unique, list())
+
+    def rows(self, table_name: str) -> list[dict]:
+        return self.tables[table_name][2]
+
+    async def load_data_file(self, table_name: str, columns: tuple[str, ...], path: Path) -> int:
+        if table_name not in self.tables:
+            raise LookupError(f"Table '{table_name}' doesn't exist")
+        table_columns, unique, rows = self.tables[table_name]
+        unknown = set(columns) - set(table_columns)
+        if unknown:
+            raise LookupError(f"Unknown columns {sorted(unknown)} in '{table_name}'")
+        self.loads.append(path)
+        taken = {row[unique] for row in rows} if unique is not None else set()
+        loaded = 0
+        for fields in read_rows(path.read_text(encoding="utf-8")):
+            fields = (fields + [None] * len(columns))[:len(columns)]
+            row = dict.fromkeys(table_columns) | dict(zip(columns, fields))
+            if unique is not None:
+                if row[unique] in taken:
+                    continue
+                taken.add(row[unique])
+            rows.append(row)
+            loaded += 1
+        return loaded
+
+
+@pytest.fixture
+def database() -> LoadDataStandIn:
+    return LoadDataStandIn()
@@ -0,0 +1,83 @@
+import asyncio
+
+from app.class_models.package import Package
+from app.class_models.row_batch import RowBatch
+from engines.bulk_load import BulkLoadSink
+
+COLUMNS = ("url", "title")
+
+
+def package(number: int, rows: list[tuple]) -> Package:
+    batch = RowBatch(columns=COLUMNS, values=[list(column) for column in zip(*rows)])
+    return Package("listings", 1, batch, sources=[f"https://example.com/{number}"])
+
+
+def test_escaped_values_load_unchanged(database, tmp_path):
+    database.create_table("listings", COLUMNS)
+    rows = [
+        ("https://example.com/tab", "a\tb"),
+        ("https://example.com/newline", "first\nsecond\r\n"),
+        ("https://example.com/backslash", "C:\\temp\\"),
+        ("https://example.com/null", None),
+        ("https://example.com/not-null", "\\N"),
+        ("https://example.com/nul", "a\0b"),
+        ("https://example.com/number", 42),
+        ("https://example.com/unicode", "žluťoučký kůň 🐴"),
+        ("https://example.com/empty", ""),
+    ]
+    sink = BulkLoadSink(database, directory=tmp_path, max_bytes=1 << 20, max_age=60)
+
+    async def run():
+        assert await sink.write(package(0, rows)) == []
+        return await sink.load_all()
+
+    assert len(asyncio.run(run())) == 1
+    expected = [{"url": url, "title": None if title is None else str(title)} for url, title in rows]
+    assert database.rows("listings") == expected
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_every_row_and_package_loaded_once(database, tmp_path):
+    database.create_table("listings", COLUMNS)
+    packages = [package(n, [(f"https://example.com/{n}/{i}", f"item\t{i}") for i in range(n % 7)]) for n in range(50)]
+    sink = BulkLoadSink(database, directory=tmp_path, max_bytes=500, max_age=60)
+
+    async def run():
+        loaded = list()
+        for item in packages:
+            loaded.extend(await sink.write(item))
+        return loaded + await sink.load_all()
+
+    loaded = asyncio.run(run())
+    assert sorted(loaded, key=lambda item: int(item.sources[0].rsplit("/", 1)[1])) == packages
+    assert all(item.data is None for item in loaded)
+    assert len(database.rows("listings")) == sum(n % 7 for n in range(50))
+    # loaded by size along the way, not all at the end
+    assert len(database.loads) > 1
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_rows_clashing_with_unique_key_are_skipped(database, tmp_path):
+    database.create_table("listings", COLUMNS, unique="url")
+    sink = BulkLoadSink(database, directory=tmp_path, max_bytes=1 << 20, max_age=60)
+    first = package(0, [("https://example.com/a", "a"), ("https://example.com/b", "b")])
+    second = package(1, [("https://example.com/b", "b again"), ("https://example.com/c", "c")])
+
+    async def run():
+        await sink.write(first)
+        await sink.write(second)
+        return await sink.load_all()
+
+    assert asyncio.run(run()) == [first, second]
+    assert [row["title"] for row in database.rows("listings")] == ["a", "b", "c"]
+
+
+def test_failed_load_is_kept(database, tmp_path):
+    sink = BulkLoadSink(database, directory=tmp_path, max_bytes=1 << 20, max_age=60)
+
+    async def run():
+        await sink.write(package(0, [("https://example.com/a", "a")]))
+        return await sink.load_all()
+
+    assert asyncio.run(run()) == []
+    assert [path.suffix for path in tmp_path.iterdir()] == [".failed"]